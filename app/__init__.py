@@ -1,11 +1,14 @@
-from flask import Flask
-import sqlite3
-from database import create_tables
-from config import DB_PATH
+import tempfile
+from flask import Flask, Request
+from config import MAX_UPLOAD_SIZE, UPLOAD_SPOOL_SIZE
 
-app = Flask(__name__)
 
-# Initialize database
-conn = sqlite3.connect(DB_PATH)
-create_tables(conn)
-conn.close()
\ No newline at end of file
+class UploadRequest(Request):
+    """Request whose file uploads stay in memory up to UPLOAD_SPOOL_SIZE and spill to disk beyond it."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+
+app = Flask(__name__)
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
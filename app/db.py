@@ -0,0 +1,33 @@
+import threading
+from flask import g
+from app import app
+from database import acquire_connection, release_connection, create_tables
+from config import DB_PATH
+
+
+# Database paths whose schema has been checked by this process
+_checked = set()
+# Held while checking, so concurrent first requests don't migrate twice
+_schema_lock = threading.Lock()
+
+
+def get_db():
+    """Return the database connection for the current app context, taking one from the pool on first use.
+
+    The schema is checked on the first connection to each database rather
+    than when the app is imported, to keep startup fast.
+    """
+    if 'db' not in g:
+        g.db = acquire_connection(DB_PATH)
+        if DB_PATH not in _checked:
+            with _schema_lock:
+                if DB_PATH not in _checked:
+                    create_tables(g.db)
+                    _checked.add(DB_PATH)
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        release_connection(conn, DB_PATH)
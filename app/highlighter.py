@@ -0,0 +1,94 @@
+import functools
+import re
+from markupsafe import Markup, escape
+from database import parse_search_terms
+
+SNIPPET_LENGTH = 300
+SNIPPET_CONTEXT = 80
+SNIPPET_FRAGMENTS = 3
+ELLIPSIS = '…'
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(query):
+    """Build one case-insensitive regex matching every term of a search query, or None.
+
+    Terms are matched the way the FTS index matches them: words as prefixes
+    of a word, phrases as whole words separated by any punctuation. The
+    alternatives are ordered longest first so the longest term wins where
+    terms overlap. Cached, since every field of every result on a page is
+    marked up against the same query.
+    """
+    parts = []
+    for term, is_phrase in parse_search_terms(query):
+        words = re.findall(r'\w+', term)
+        pattern = r'\W+'.join(re.escape(word) for word in words)
+        parts.append(r'\b' + pattern + (r'\b' if is_phrase else r'\w*'))
+    if not parts:
+        return None
+    parts.sort(key=len, reverse=True)
+    return re.compile('|'.join(parts), re.IGNORECASE)
+
+def _mark(text, matches, start, end):
+    """HTML-escape text[start:end], wrapping the given matches (clipped to the range) in <mark>."""
+    out = []
+    pos = start
+    for match in matches:
+        match_start, match_end = max(match.start(), start), min(match.end(), end)
+        if match_start >= match_end:
+            continue
+        out.append(escape(text[pos:match_start]))
+        out.append(Markup('<mark>%s</mark>') % text[match_start:match_end])
+        pos = match_end
+    out.append(escape(text[pos:end]))
+    return Markup('').join(out)
+
+def highlight(text, query):
+    """Return text as escaped HTML with every match of the query wrapped in <mark>."""
+    if not text:
+        return Markup('')
+    pattern = compile_query(query) if query else None
+    if pattern is None:
+        return escape(text)
+    return _mark(text, list(pattern.finditer(text)), 0, len(text))
+
+def _widen_to_word(text, start, end):
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    return start, end
+
+def snippet(text, query, max_length=SNIPPET_LENGTH, context=SNIPPET_CONTEXT, max_fragments=SNIPPET_FRAGMENTS):
+    """Like highlight, but trims long text to a few fragments around the matches.
+
+    Text up to ``max_length`` characters is returned whole. Otherwise each of
+    the first matches gets ``context`` characters either side (widened to
+    whole words); overlapping windows are merged and gaps shown as an ellipsis.
+    """
+    if not text:
+        return Markup('')
+    if len(text) <= max_length:
+        return highlight(text, query)
+    pattern = compile_query(query) if query else None
+    matches = list(pattern.finditer(text)) if pattern else []
+    if not matches:
+        # Matched on a field other than this one: just show the start
+        cut = text.rfind(' ', 0, max_length)
+        return escape(text[:cut if cut > 0 else max_length]) + ELLIPSIS
+    windows = []
+    for match in matches:
+        start, end = _widen_to_word(text, max(match.start() - context, 0), min(match.end() + context, len(text)))
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(end, windows[-1][1]))
+        elif len(windows) == max_fragments:
+            break
+        else:
+            windows.append((start, end))
+    fragments = [_mark(text, matches, start, end).strip() for start, end in windows]
+    result = Markup(' %s ' % ELLIPSIS).join(fragments)
+    if windows[0][0] > 0:
+        result = ELLIPSIS + result
+    if windows[-1][1] < len(text):
+        result = result + ELLIPSIS
+    return result
@@ -0,0 +1,137 @@
+"""Background import jobs.
+
+An uploaded clippings file is imported on a worker thread so the request
+can return at once with a job id, which the imports page polls for
+progress. SQLite allows a single writer, so only one job runs at a time.
+"""
+import datetime
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+from database import connect, import_highlights, set_last_import_date
+
+# Finished jobs kept around for their status pages
+MAX_FINISHED_JOBS = 20
+# Entries parsed between updates of the job's byte position
+PROGRESS_INTERVAL = 1000
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_writer_lock = threading.Lock()
+
+
+@dataclass
+class ImportJob:
+    id: str
+    filename: str
+    total_bytes: int
+    status: str = 'queued'  # queued, running, done or failed
+    bytes_read: int = 0
+    parsed: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    error: Optional[str] = None
+    index_error: Optional[str] = None  # the import succeeded but the related-highlights index was not updated
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    completed: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
+
+    @property
+    def running(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        """Return the job's progress as JSON-ready data, with rate (entries/s) and ETA (seconds)."""
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0
+        rate = self.parsed / elapsed if elapsed else None
+        eta = None
+        if self.status == 'running' and self.bytes_read and elapsed:
+            eta = (self.total_bytes - self.bytes_read) * elapsed / self.bytes_read
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'bytes_read': self.bytes_read,
+            'total_bytes': self.total_bytes,
+            'parsed': self.parsed,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': eta,
+            'error': self.error,
+            'index_error': self.index_error,
+        }
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def current_job():
+    """Return the job that is queued or running, or None."""
+    with _jobs_lock:
+        return next((job for job in _jobs.values() if job.running), None)
+
+def start_import(db_path, fileobj, filename):
+    """Import the clippings in a binary file object into db_path on a worker thread.
+
+    The job takes ownership of the file and closes it when done. Returns the
+    new ImportJob, or None (leaving the file alone) if another import is
+    still running.
+    """
+    if not _writer_lock.acquire(blocking=False):
+        return None
+    total_bytes = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    job = ImportJob(id=uuid.uuid4().hex, filename=filename, total_bytes=total_bytes)
+    with _jobs_lock:
+        finished = [job_id for job_id, other in _jobs.items() if not other.running]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS + 1, 0)]:
+            del _jobs[job_id]
+        _jobs[job.id] = job
+    thread = threading.Thread(target=_run, args=(job, db_path, fileobj), name=f'import-{job.id}', daemon=True)
+    thread.start()
+    return job
+
+def _track(job, entries, fileobj):
+    """Pass entries through, counting them and recording how far into the file the parser is."""
+    for entry in entries:
+        job.parsed += 1
+        if job.parsed % PROGRESS_INTERVAL == 0:
+            job.bytes_read = fileobj.tell()
+        yield entry
+
+def _run(job, db_path, fileobj):
+    conn = None
+    try:
+        from parser import iter_clippings  # only needed once something is imported
+        job.status = 'running'
+        job.started = time.monotonic()
+        conn = connect(db_path)
+
+        def progress(inserted, skipped):
+            job.inserted, job.skipped = inserted, skipped
+
+        import_highlights(conn, _track(job, iter_clippings(fileobj), fileobj), progress=progress)
+        job.bytes_read = job.total_bytes
+        set_last_import_date(conn, datetime.datetime.now().isoformat())
+        # The highlights are committed by now, so an index failure doesn't fail the import
+        try:
+            import related
+            related.update_index(conn, db_path)
+        except Exception as e:
+            job.index_error = str(e)
+        job.status = 'done'
+    except Exception as e:
+        job.error = str(e)
+        job.status = 'failed'
+    finally:
+        job.finished = time.monotonic()
+        if conn is not None:
+            conn.close()
+        fileobj.close()
+        _writer_lock.release()
+        job.completed.set()
@@ -1,8 +1,11 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Sequence
 
+# Models are slotted: no per-instance __dict__, which matters for long
+# listings. The data layer builds them positionally from rows, so keep
+# field order in step with the *_COLUMNS lists in database.py.
 
-@dataclass
+@dataclass(slots=True)
 class Book:
     title: str
     author: str
@@ -10,7 +13,7 @@ class Book:
     highlight_count: Optional[int] = None
     last_highlight_date: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Highlight:
     book_id: int
     highlight_type: str
@@ -19,14 +22,17 @@ class Highlight:
     date_added: Optional[str]
     quote: str
     id: Optional[int] = None
+    color: Optional[str] = None
+    note: Optional[str] = None
+    tags: Sequence['Tag'] = ()  # filled in by attach_tags; shared empty default costs nothing per instance
 
-@dataclass
+@dataclass(slots=True)
 class Tag:
     name: str
     id: Optional[int] = None
     highlight_count: Optional[int] = None
     
-@dataclass
+@dataclass(slots=True)
 class HighlightTag:
     highlight_id: int
     tag_id: int
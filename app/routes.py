@@ -1,57 +1,198 @@
-from flask import render_template, request, jsonify
-from app import app
-import sqlite3
-import re
-from database import get_books_with_stats, get_highlights_for_book, get_book_by_id, search_highlights, get_all_tags, get_tag_by_id, insert_tag, update_tag, delete_tag, get_highlights_for_book_with_tags, add_tag_to_highlight, remove_tag_from_highlight, get_tags_for_highlight, get_highlights_for_tag, get_last_import_date, set_last_import_date, insert_book, insert_highlight
-from config import DB_PATH
+from flask import render_template, request, jsonify, make_response, redirect, url_for, Response, stream_with_context
+from app import app, db, jobs
+from app.db import get_db
+from app import highlighter
+from database import get_books_with_stats, get_highlights_for_book, get_book_by_id, search_highlights, get_highlights_for_book_page, search_highlights_page, PAGE_SIZE, get_all_tags, get_tags_with_counts, get_tag_by_id, insert_tag, update_tag, delete_tag, get_highlights_for_book_with_tags, add_tag_to_highlight, remove_tag_from_highlight, get_tags_for_highlight, get_highlights_for_tag, get_last_import_date, get_generation, set_tags_for_highlight, get_highlights_by_ids, fuzzy_search_highlights, SCHEMA_VERSION
 import datetime
-from parser import parse_clippings
+import functools
+import hashlib
+import io
+import os
+import export
+from werkzeug.exceptions import RequestEntityTooLarge
 
-def highlight_text(text, query):
-    if not query:
-        return text
-    # Case-insensitive replace with <mark>
-    pattern = re.compile(re.escape(query), re.IGNORECASE)
-    return pattern.sub(lambda m: f'<mark>{m.group()}</mark>', text)
+@functools.cache
+def app_version():
+    """Short hash of the schema version and the app package's code, templates and static files.
+
+    Read once, on the first conditional request, so upgrading the app
+    invalidates responses cached under the previous version.
+    """
+    digest = hashlib.sha1(str(SCHEMA_VERSION).encode('ascii'))
+    for root, dirs, files in os.walk(app.root_path):
+        dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+        for name in sorted(files):
+            digest.update(name.encode('utf-8'))
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+def conditional(view):
+    """Answer GET requests with 304 Not Modified while the library and the app are unchanged.
+
+    Pages and JSON only depend on the URL, the database and the app's own
+    code, so the app version and library generation make a validator that
+    costs one metadata lookup to check.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        generation, modified = get_generation(get_db())
+        etag = f"{app_version()}-{generation}-{modified}"
+        # Nothing written yet leaves no date to validate against
+        last_modified = datetime.datetime.fromtimestamp(modified, datetime.timezone.utc) if modified else None
+        if request.if_none_match:
+            unchanged = request.if_none_match.contains_weak(etag)
+        else:
+            unchanged = (last_modified is not None and request.if_modified_since is not None
+                         and request.if_modified_since >= last_modified)
+        response = make_response('', 304) if unchanged else make_response(view(*args, **kwargs))
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def highlight_search_results(search_results, query):
+    """Pair each search result with its title, author and quote marked up for the query."""
+    return [
+        (highlight, book, highlighter.snippet(highlight.quote, query), highlighter.highlight(book.title, query), highlighter.highlight(book.author, query))
+        for highlight, book in search_results
+    ]
+
+def search_page(conn, query, cursor=None, limit=PAGE_SIZE):
+    """Return (results, next_cursor, corrections) for a page of search results.
+
+    When the exact search has nothing for a query, its first page falls back
+    to the typo-tolerant search; corrections are then the words searched
+    for instead, and there is no next page.
+    """
+    results, next_cursor = search_highlights_page(conn, query, cursor, limit)
+    if results or cursor:
+        return results, next_cursor, None
+    results, corrections = fuzzy_search_highlights(conn, query, limit)
+    return results, None, corrections
+
+def highlight_to_dict(highlight, book=None):
+    data = {
+        'id': highlight.id,
+        'book_id': highlight.book_id,
+        'highlight_type': highlight.highlight_type,
+        'page': highlight.page,
+        'location': highlight.location,
+        'date_added': highlight.date_added,
+        'quote': highlight.quote,
+        'color': highlight.color,
+        'note': highlight.note,
+        'tags': [{'id': t.id, 'name': t.name} for t in highlight.tags],
+    }
+    if book is not None:
+        data['book'] = {'id': book.id, 'title': book.title, 'author': book.author}
+    return data
+
+def page_limit():
+    return max(1, min(request.args.get('limit', PAGE_SIZE, type=int), 500))
 
 @app.route('/')
+@conditional
 def index():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     books = get_books_with_stats(conn)
     query = request.args.get('q', '').strip()
     selected_book_id = request.args.get('book_id', type=int)
+    next_cursor = None
+    corrections = None
     
     if query:
         # Search mode
-        search_results = search_highlights(conn, query)
-        highlights = []
-        for highlight, book in search_results:
-            highlighted_quote = highlight_text(highlight.quote, query)
-            highlighted_title = highlight_text(book.title, query)
-            highlighted_author = highlight_text(book.author, query)
-            # Add tags
-            highlight.tags = get_tags_for_highlight(conn, highlight.id)
-            highlights.append((highlight, book, highlighted_quote, highlighted_title, highlighted_author))
+        search_results, next_cursor, corrections = search_page(conn, query)
+        highlights = highlight_search_results(search_results, corrections or query)
         selected_book = None
     elif selected_book_id:
-        highlights = get_highlights_for_book_with_tags(conn, selected_book_id)
+        highlights, next_cursor = get_highlights_for_book_page(conn, selected_book_id)
         selected_book = get_book_by_id(conn, selected_book_id)
     else:
         highlights = []
         selected_book = None
     
     all_tags = get_all_tags(conn)
-    conn.close()
-    return render_template('index.html', books=books, highlights=highlights, selected_book=selected_book, query=query, all_tags=all_tags)
+    return render_template('index.html', books=books, highlights=highlights, selected_book=selected_book, query=query, all_tags=all_tags, next_cursor=next_cursor, corrections=corrections)
+
+@app.route('/api/books/<int:book_id>/highlights')
+@conditional
+def book_highlights_api(book_id):
+    conn = get_db()
+    try:
+        highlights, next_cursor = get_highlights_for_book_page(conn, book_id, request.args.get('cursor'), page_limit())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    all_tags = get_all_tags(conn)
+    return jsonify({
+        'highlights': [highlight_to_dict(h) for h in highlights],
+        'next_cursor': next_cursor,
+        'html': render_template('_highlight_cards.html', highlights=highlights, query='', all_tags=all_tags),
+    })
+
+@app.route('/api/search')
+@conditional
+def search_api():
+    query = request.args.get('q', '').strip()
+    conn = get_db()
+    try:
+        search_results, next_cursor, corrections = search_page(conn, query, request.args.get('cursor'), page_limit())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    all_tags = get_all_tags(conn)
+    return jsonify({
+        'highlights': [highlight_to_dict(h, b) for h, b in search_results],
+        'next_cursor': next_cursor,
+        'corrections': corrections,
+        'html': render_template('_highlight_cards.html', highlights=highlight_search_results(search_results, corrections or query), query=query, all_tags=all_tags),
+    })
+
+@app.route('/api/highlights/<int:highlight_id>/related')
+@conditional
+def related_highlights_api(highlight_id):
+    import related  # loads NumPy, which nothing else in the app needs
+    conn = get_db()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    try:
+        matches = related.find_related(conn, db.DB_PATH, highlight_id, limit)
+    except KeyError:
+        return jsonify({'error': 'Unknown highlight'}), 404
+    scores = dict(matches)
+    return jsonify({
+        'highlight_id': highlight_id,
+        'related': [dict(highlight_to_dict(h, b), score=round(scores[h.id], 4))
+                    for h, b in get_highlights_by_ids(conn, [match_id for match_id, _ in matches])],
+    })
+
+@app.route('/export')
+def export_highlights():
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = export.export_library(
+            get_db(), fmt,
+            book_id=request.args.get('book_id', type=int),
+            tag_id=request.args.get('tag_id', type=int),
+            since=request.args.get('since'),
+            before=request.args.get('before'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    _, mimetype, extension = export.FORMATS[fmt]
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="highlights.{extension}"'})
 
 @app.route('/add_tag_to_highlight', methods=['POST'])
 def add_tag_to_highlight_route():
     highlight_id = request.form.get('highlight_id', type=int)
     tag_id = request.form.get('tag_id', type=int)
     if highlight_id and tag_id:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         add_tag_to_highlight(conn, highlight_id, tag_id)
-        conn.close()
     return '', 204
 
 @app.route('/remove_tag_from_highlight', methods=['POST'])
@@ -59,18 +200,17 @@ def remove_tag_from_highlight_route():
     highlight_id = request.form.get('highlight_id', type=int)
     tag_id = request.form.get('tag_id', type=int)
     if highlight_id and tag_id:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         remove_tag_from_highlight(conn, highlight_id, tag_id)
-        conn.close()
     return '', 204
 
 @app.route('/get_tags_for_highlight')
+@conditional
 def get_tags_for_highlight_route():
     highlight_id = request.args.get('highlight_id', type=int)
     if highlight_id:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         tags = get_tags_for_highlight(conn, highlight_id)
-        conn.close()
         return jsonify([{'id': t.id, 'name': t.name} for t in tags])
     return jsonify([])
 
@@ -80,19 +220,13 @@ def update_highlight_tags():
     highlight_id = data.get('highlight_id')
     tag_ids = data.get('tag_ids', [])
     if highlight_id:
-        conn = sqlite3.connect(DB_PATH)
-        # Remove all current tags
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM highlight_tags WHERE highlight_id = ?", (highlight_id,))
-        # Add new tags
-        for tag_id in tag_ids:
-            add_tag_to_highlight(conn, highlight_id, tag_id)
-        conn.close()
+        set_tags_for_highlight(get_db(), highlight_id, tag_ids)
     return '', 204
 
 @app.route('/tags', methods=['GET', 'POST'])
+@conditional
 def tags():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'add':
@@ -110,13 +244,7 @@ def tags():
                 delete_tag(conn, tag_id)
     
     selected_tag_id = request.args.get('tag_id', type=int)
-    tags_list = get_all_tags(conn)
-    
-    # Add highlight count to each tag
-    for tag in tags_list:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM highlight_tags WHERE tag_id = ?", (tag.id,))
-        tag.highlight_count = cursor.fetchone()[0]
+    tags_list = get_tags_with_counts(conn)
     
     if selected_tag_id:
         highlights = get_highlights_for_tag(conn, selected_tag_id)
@@ -125,38 +253,41 @@ def tags():
         highlights = []
         selected_tag = None
     
-    all_tags = get_all_tags(conn)
-    conn.close()
-    return render_template('tags.html', tags=tags_list, highlights=highlights, selected_tag=selected_tag, all_tags=all_tags)
+    return render_template('tags.html', tags=tags_list, highlights=highlights, selected_tag=selected_tag, all_tags=tags_list)
 
 @app.route('/imports', methods=['GET', 'POST'])
 def imports():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     last_import_date = get_last_import_date(conn)
-    processed_count = 0
-    total_parsed = 0
     message = None
+    status = 200
     
     if request.method == 'POST':
         file = request.files.get('clippings_file')
         if file and file.filename:
-            text = file.read().decode('utf-8-sig')
-            parsed_entries = parse_clippings(text)
-            total_parsed = len(parsed_entries)
-            if last_import_date:
-                parsed_entries = [e for e in parsed_entries if not e[1].date_added or e[1].date_added > last_import_date]
-            
-            for book, highlight in parsed_entries:
-                book_id = insert_book(conn, book.title, book.author)
-                insert_highlight(conn, book_id, highlight.highlight_type, highlight.page, highlight.location, highlight.date_added, highlight.quote)
-            
-            processed_count = len(parsed_entries)
-            now_iso = datetime.datetime.now().isoformat()
-            set_last_import_date(conn, now_iso)
-            message = f"Parsed {total_parsed} highlights, imported {processed_count} new highlights."
-            last_import_date = now_iso  # Update for display
+            # Hand the spooled upload to the job; otherwise it is closed when the request ends
+            upload, file.stream = file.stream, io.BytesIO()
+            job = jobs.start_import(db.DB_PATH, upload, file.filename)
+            if job:
+                return redirect(url_for('imports', job=job.id))
+            upload.close()
+            message = "Another import is still running; try again when it has finished."
+            status = 409
         else:
             message = "No file selected."
     
-    conn.close()
-    return render_template('imports.html', last_import_date=last_import_date, processed_count=processed_count, total_parsed=total_parsed, message=message)
\ No newline at end of file
+    job = jobs.get_job(request.args.get('job', '')) or jobs.current_job()
+    return render_template('imports.html', last_import_date=last_import_date, message=message, job=job), status
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(error):
+    limit = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    message = f"That file is too large to import (the limit is {limit} MB)."
+    return render_template('imports.html', last_import_date=get_last_import_date(get_db()), message=message, job=jobs.current_job()), 413
+
+@app.route('/api/imports/<job_id>')
+def import_status(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown import job'}), 404
+    return jsonify(job.to_dict())
@@ -1,5 +1,13 @@
 #!/bin/bash
 # Build script for BookMarker app
-echo "Building BookMarker executable..."
-pyinstaller --onefile --add-data "app:app" run.py
-echo "Build complete! Executable is in dist/run"
\ No newline at end of file
+#   ./build.sh           single-file executable (dist/run), unpacks itself on every launch
+#   ./build.sh --onedir  folder build (dist/run/run), starts faster as nothing is unpacked
+if [ "$1" == "--onedir" ]; then
+    echo "Building BookMarker folder build..."
+    pyinstaller --onedir --noconfirm --add-data "app:app" run.py
+    echo "Build complete! Executable is in dist/run/run"
+else
+    echo "Building BookMarker executable..."
+    pyinstaller --onefile --add-data "app:app" run.py
+    echo "Build complete! Executable is in dist/run"
+fi
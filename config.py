@@ -1,2 +1,6 @@
 DB_PATH = 'bookmarker.db'
-CLIPPINGS_FILE = 'My Clippings.txt'
\ No newline at end of file
+CLIPPINGS_FILE = 'My Clippings.txt'
+# Largest clippings upload accepted by /imports, in bytes
+MAX_UPLOAD_SIZE = 256 * 1024 * 1024
+# Uploads are kept in memory up to this size and spooled to disk beyond it
+UPLOAD_SPOOL_SIZE = 1024 * 1024
\ No newline at end of file
@@ -1,7 +1,72 @@
 import sqlite3
+import re
+import json
+import base64
+import queue
+import bisect
+import os
+import threading
+import unicodedata
 from app.models import Book, Highlight, Tag
 
-def create_tables(conn):
+# Connection settings applied to every connection we open. WAL lets readers
+# proceed while an import is writing; NORMAL sync is safe under WAL.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-32000",  # 32 MB page cache
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+POOL_SIZE = 8
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def connect(db_path):
+    """Open a connection to db_path with the tuned pragmas applied.
+
+    The connection may be handed between threads (one at a time), which is
+    what the pool below relies on.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _get_pool(db_path):
+    with _pools_lock:
+        if db_path not in _pools:
+            _pools[db_path] = queue.LifoQueue(POOL_SIZE)
+        return _pools[db_path]
+
+def acquire_connection(db_path):
+    """Take an idle pooled connection for db_path, opening a new one if none is free."""
+    try:
+        return _get_pool(db_path).get_nowait()
+    except queue.Empty:
+        return connect(db_path)
+
+def release_connection(conn, db_path):
+    """Return a connection to the pool, rolling back anything left uncommitted."""
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _get_pool(db_path).put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+def close_connections(db_path):
+    """Close every idle pooled connection for db_path."""
+    pool = _get_pool(db_path)
+    while True:
+        try:
+            pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+def _create_base_schema(conn):
     cursor = conn.cursor()
     # Books table
     cursor.execute('''
@@ -26,6 +91,7 @@ def create_tables(conn):
             UNIQUE(book_id, location)
         )
     ''')
+    create_location_index(conn)
     # Tags (for future)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS tags (
@@ -42,6 +108,8 @@ def create_tables(conn):
             FOREIGN KEY(tag_id) REFERENCES tags(id)
         )
     ''')
+    # The primary key only serves lookups by highlight; this one serves lookups by tag
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_highlight_tags_tag ON highlight_tags(tag_id, highlight_id)")
 
     # Anchor table (for future)
     cursor.execute('''
@@ -50,8 +118,243 @@ def create_tables(conn):
                    value TEXT
                    )
     ''')
+    create_search_index(conn)
+    create_book_stats(conn)
     conn.commit()
 
+def _index_highlights_by_book_date(conn):
+    # Serves a book's highlights newest first without sorting them
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_highlights_book_date ON highlights(book_id, date_added)")
+
+def _add_notebook_columns(conn):
+    # Kindle notebook exports carry a highlight colour and an attached note
+    columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(highlights)")}
+    for name in ('color', 'note'):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE highlights ADD COLUMN {name} TEXT")
+
+def _log_highlight_changes(conn):
+    """Log highlights whose quote changes or that are deleted, for indexes kept outside the database.
+
+    New highlights need no entry: they are found by id, above the highest
+    id an index has already seen.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS highlight_changes (
+            seq INTEGER PRIMARY KEY,
+            highlight_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS highlight_changes_update AFTER UPDATE OF quote ON highlights
+        WHEN old.quote IS NOT new.quote BEGIN
+            INSERT INTO highlight_changes (highlight_id) VALUES (new.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS highlight_changes_delete AFTER DELETE ON highlights BEGIN
+            INSERT INTO highlight_changes (highlight_id) VALUES (old.id);
+        END
+    ''')
+
+def _create_search_terms(conn):
+    """Create search_terms, every word of the search index, with a trigram index for spelling corrections.
+
+    The search index has no cheap way to list its words, so imports add the
+    words of what they write (see _add_search_terms). Existing databases
+    are backfilled once from the index's vocabulary.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='search_terms'")
+    needs_backfill = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_terms (
+            id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_terms_trigram USING fts5(
+            term,
+            content = 'search_terms',
+            content_rowid = 'id',
+            tokenize = 'trigram'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_terms_insert AFTER INSERT ON search_terms BEGIN
+            INSERT INTO search_terms_trigram (rowid, term) VALUES (new.id, new.term);
+        END
+    ''')
+    if needs_backfill:
+        cursor.execute("CREATE VIRTUAL TABLE temp.highlights_fts_vocab USING fts5vocab(main, highlights_fts, 'row')")
+        cursor.execute("INSERT OR IGNORE INTO search_terms (term) SELECT term FROM temp.highlights_fts_vocab WHERE length(term) >= ?",
+                       (MIN_FUZZY_WORD,))
+        cursor.execute("DROP TABLE temp.highlights_fts_vocab")
+
+# Schema migrations in the order they are applied. A database records how
+# many it has had in PRAGMA user_version. Each step must be safe to re-run,
+# as a crash between a step and its version bump repeats it next time.
+MIGRATIONS = (
+    _create_base_schema,  # 1: tables, location columns, search index, book stats
+    _index_highlights_by_book_date,  # 2
+    _add_notebook_columns,  # 3
+    _log_highlight_changes,  # 4
+    _create_search_terms,  # 5
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn):
+    """Apply the migrations the database has not had yet, one version at a time.
+
+    A current database costs a single PRAGMA read. Returns the number of
+    migrations applied.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this version of BookMarker ({SCHEMA_VERSION})")
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        MIGRATIONS[number - 1](conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    return SCHEMA_VERSION - version
+
+def create_tables(conn):
+    """Create the schema, or bring an existing database up to the current version."""
+    migrate(conn)
+
+# Numeric bounds of a "6982-6984" (or single "1234") location, kept as virtual columns
+LOCATION_COLUMNS = {
+    'loc_start': "CAST(location AS INTEGER)",
+    'loc_end': "CAST(CASE WHEN instr(location, '-') THEN substr(location, instr(location, '-') + 1) ELSE location END AS INTEGER)",
+}
+
+def create_location_index(conn):
+    """Add the loc_start/loc_end columns to highlights (if missing) and index them per book."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_xinfo(highlights)")
+    columns = {row[1] for row in cursor.fetchall()}
+    for name, expression in LOCATION_COLUMNS.items():
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE highlights ADD COLUMN {name} INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_highlights_book_location ON highlights(book_id, loc_start, loc_end)")
+
+def create_book_stats(conn):
+    """Create book_stats, the per-book highlight count and latest highlight date, and its triggers.
+
+    The sidebar lists books by their latest highlight, so keeping these
+    figures up to date on write saves a GROUP BY over every highlight on
+    each page view. Existing databases are backfilled when the table is created.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='book_stats'")
+    needs_backfill = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book_stats (
+            book_id INTEGER PRIMARY KEY,
+            highlight_count INTEGER NOT NULL DEFAULT 0,
+            last_highlight_date TEXT,
+            FOREIGN KEY(book_id) REFERENCES books(id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_book_stats_last_highlight ON book_stats(last_highlight_date DESC)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS book_stats_book_insert AFTER INSERT ON books BEGIN
+            INSERT OR IGNORE INTO book_stats (book_id) VALUES (new.id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS book_stats_book_delete AFTER DELETE ON books BEGIN
+            DELETE FROM book_stats WHERE book_id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS book_stats_highlight_insert AFTER INSERT ON highlights BEGIN
+            UPDATE book_stats SET
+                highlight_count = highlight_count + 1,
+                last_highlight_date = CASE
+                    WHEN new.date_added IS NOT NULL AND (last_highlight_date IS NULL OR new.date_added > last_highlight_date)
+                    THEN new.date_added ELSE last_highlight_date END
+            WHERE book_id = new.book_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS book_stats_highlight_delete AFTER DELETE ON highlights BEGIN
+            UPDATE book_stats SET
+                highlight_count = highlight_count - 1,
+                last_highlight_date = CASE
+                    WHEN old.date_added = last_highlight_date
+                    THEN (SELECT MAX(date_added) FROM highlights WHERE book_id = old.book_id)
+                    ELSE last_highlight_date END
+            WHERE book_id = old.book_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS book_stats_highlight_update AFTER UPDATE OF book_id, date_added ON highlights BEGIN
+            UPDATE book_stats SET
+                highlight_count = (SELECT COUNT(*) FROM highlights WHERE book_id = book_stats.book_id),
+                last_highlight_date = (SELECT MAX(date_added) FROM highlights WHERE book_id = book_stats.book_id)
+            WHERE book_id IN (old.book_id, new.book_id);
+        END
+    ''')
+    if needs_backfill:
+        cursor.execute('''
+            INSERT OR REPLACE INTO book_stats (book_id, highlight_count, last_highlight_date)
+            SELECT b.id, COUNT(h.id), MAX(h.date_added)
+            FROM books b
+            LEFT JOIN highlights h ON b.id = h.book_id
+            GROUP BY b.id
+        ''')
+
+def create_search_index(conn):
+    """Create the FTS5 index over quote/title/author and the triggers that keep it in sync.
+
+    The index row id is the highlight id. Databases created before the index
+    existed are backfilled once, when the virtual table is first created.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='highlights_fts'")
+    needs_backfill = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS highlights_fts USING fts5(
+            quote,
+            title,
+            author,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS highlights_fts_insert AFTER INSERT ON highlights BEGIN
+            INSERT INTO highlights_fts (rowid, quote, title, author)
+            SELECT new.id, new.quote, b.title, b.author FROM books b WHERE b.id = new.book_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS highlights_fts_delete AFTER DELETE ON highlights BEGIN
+            DELETE FROM highlights_fts WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS highlights_fts_update AFTER UPDATE OF quote, book_id ON highlights BEGIN
+            DELETE FROM highlights_fts WHERE rowid = old.id;
+            INSERT INTO highlights_fts (rowid, quote, title, author)
+            SELECT new.id, new.quote, b.title, b.author FROM books b WHERE b.id = new.book_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+            UPDATE highlights_fts SET title = new.title, author = new.author
+            WHERE rowid IN (SELECT id FROM highlights WHERE book_id = new.id);
+        END
+    ''')
+    if needs_backfill:
+        cursor.execute('''
+            INSERT INTO highlights_fts (rowid, quote, title, author)
+            SELECT h.id, h.quote, b.title, b.author
+            FROM highlights h
+            JOIN books b ON h.book_id = b.id
+        ''')
+
 def get_last_import_date(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT value FROM import_metadata WHERE key = 'last_import_date'")
@@ -68,90 +371,349 @@ def set_last_import_date(conn, date_str):
     conn.commit()
 
 
-def get_books_with_stats(conn):
+def get_generation(conn):
+    """Return the library's (generation, modified) pair, or (0, None) if nothing was written yet.
+
+    The generation is a counter bumped by every write to books, highlights
+    or tags; modified is the Unix time of the last bump.
+    """
     cursor = conn.cursor()
+    cursor.execute("SELECT key, value FROM import_metadata WHERE key IN ('generation', 'generation_modified')")
+    values = dict(cursor.fetchall())
+    if 'generation' not in values:
+        return 0, None
+    return int(values['generation']), int(values['generation_modified'])
+
+def bump_generation(cursor):
+    """Mark the library as changed. Call inside the writing transaction, before it commits."""
     cursor.execute("""
-        SELECT b.id, b.title, b.author, COUNT(h.id) as highlight_count, MAX(h.date_added) as last_highlight_date
-        FROM books b
-        LEFT JOIN highlights h ON b.id = h.book_id
-        GROUP BY b.id, b.title, b.author
-        ORDER BY last_highlight_date DESC
+        INSERT INTO import_metadata (key, value)
+        VALUES ('generation', '1'), ('generation_modified', strftime('%s', 'now'))
+        ON CONFLICT(key) DO UPDATE SET value = CASE key WHEN 'generation' THEN value + 1 ELSE excluded.value END
     """)
-    results = cursor.fetchall()
-    
-    books = []
-    for row in results:
-        book = Book(
-            id=row[0],
-            title=row[1],
-            author=row[2],
-            highlight_count=row[3],
-            last_highlight_date=row[4]
-        )
-        books.append(book)
-    
-    return books
 
-def get_highlights_for_book(conn, book_id):
+def get_import_checkpoint(conn):
+    """Return the saved clippings checkpoint as a dict with size, offset and prefix_hash, or None."""
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT h.id, h.highlight_type, h.page, h.location, h.date_added, h.quote
-        FROM highlights h
-        WHERE h.book_id = ?
-        ORDER BY h.date_added DESC
-    """, (book_id,))
-    results = cursor.fetchall()
-    
-    highlights = []
-    for row in results:
-        highlight = Highlight(
-            id=row[0],
-            book_id=book_id,
-            highlight_type=row[1],
-            page=row[2],
-            location=row[3],
-            date_added=row[4],
-            quote=row[5]
-        )
-        highlights.append(highlight)
-    
-    return highlights
+        SELECT key, value FROM import_metadata
+        WHERE key IN ('clippings_size', 'clippings_offset', 'clippings_prefix_hash')
+    """)
+    values = dict(cursor.fetchall())
+    if len(values) < 3:
+        return None
+    return {
+        'size': int(values['clippings_size']),
+        'offset': int(values['clippings_offset']),
+        'prefix_hash': values['clippings_prefix_hash'],
+    }
 
-def get_book_by_id(conn, book_id):
+def set_import_checkpoint(conn, size, offset, prefix_hash):
     cursor = conn.cursor()
-    cursor.execute("SELECT id, title, author FROM books WHERE id = ?", (book_id,))
-    row = cursor.fetchone()
-    if row:
-        return Book(id=row[0], title=row[1], author=row[2])
-    return None
+    cursor.executemany("""
+        INSERT INTO import_metadata (key, value) 
+        VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value
+    """, [('clippings_size', str(size)), ('clippings_offset', str(offset)), ('clippings_prefix_hash', prefix_hash)])
+    conn.commit()
+
+# Row mapping: SELECTs list model columns in the models' field order, so a
+# cursor's row_factory builds each model straight from the row.
+BOOK_COLUMNS = "b.title, b.author, b.id"
+HIGHLIGHT_COLUMNS = "h.book_id, h.highlight_type, h.page, h.location, h.date_added, h.quote, h.id, h.color, h.note"
+TAG_COLUMNS = "t.name, t.id"
+_HIGHLIGHT_WIDTH = 9
+_BOOK_WIDTH = 3
+
+def _book_row(cursor, row):
+    return Book(*row)
+
+def _highlight_row(cursor, row):
+    return Highlight(*row)
+
+def _tag_row(cursor, row):
+    return Tag(*row)
+
+def _highlight_book_row(cursor, row):
+    return Highlight(*row[:_HIGHLIGHT_WIDTH]), Book(*row[_HIGHLIGHT_WIDTH:])
 
-def search_highlights(conn, query):
+def _search_row(cursor, row):
+    book_end = _HIGHLIGHT_WIDTH + _BOOK_WIDTH
+    return Highlight(*row[:_HIGHLIGHT_WIDTH]), Book(*row[_HIGHLIGHT_WIDTH:book_end]), row[book_end]
+
+def _query(conn, row_factory, sql, params=()):
+    """Execute sql on a fresh cursor that maps each row with row_factory, and return the cursor."""
     cursor = conn.cursor()
-    like_query = f'%{query}%'
-    cursor.execute("""
-        SELECT h.id, h.highlight_type, h.page, h.location, h.date_added, h.quote, b.id, b.title, b.author
+    cursor.row_factory = row_factory
+    return cursor.execute(sql, params)
+
+def iter_books_with_stats(conn):
+    """Yield every book with highlight_count and last_highlight_date set, most recently highlighted first."""
+    return _query(conn, _book_row, f"""
+        SELECT {BOOK_COLUMNS}, s.highlight_count, s.last_highlight_date
+        FROM book_stats s
+        JOIN books b ON b.id = s.book_id
+        ORDER BY s.last_highlight_date DESC
+    """)
+
+def get_books_with_stats(conn):
+    return list(iter_books_with_stats(conn))
+
+PAGE_SIZE = 50
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row on a page as an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor. Returns None for an empty cursor.
+
+    Raises ValueError if the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid cursor")
+    key, highlight_id = values
+    # Both end up as query parameters, so anything else would fail in sqlite3
+    if isinstance(key, bool) or not isinstance(key, (str, int, float, type(None))):
+        raise ValueError("Invalid cursor")
+    if isinstance(highlight_id, bool) or not isinstance(highlight_id, int):
+        raise ValueError("Invalid cursor")
+    return key, highlight_id
+
+def _date_keyset(after):
+    """WHERE fragment continuing a (date_added DESC, id DESC) listing after the given key.
+
+    NULL dates sort last, so they need their own branch.
+    """
+    date_added, highlight_id = after
+    if date_added is None:
+        return " AND h.date_added IS NULL AND h.id < ?", [highlight_id]
+    return " AND ((h.date_added, h.id) < (?, ?) OR h.date_added IS NULL)", [date_added, highlight_id]
+
+def _paginate(rows, limit, key):
+    """Trim a limit + 1 row fetch to a page and build the cursor for the next one."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+def iter_highlights_for_book(conn, book_id, limit=None, after=None):
+    """Yield a book's highlights, newest first, as they are read.
+
+    ``after`` is the (date_added, id) key of the last highlight already seen
+    and ``limit`` caps the number of rows, for keyset pagination.
+    """
+    sql = f"""
+        SELECT {HIGHLIGHT_COLUMNS}
         FROM highlights h
+        WHERE h.book_id = ?
+    """
+    params = [book_id]
+    if after:
+        clause, clause_params = _date_keyset(after)
+        sql += clause
+        params += clause_params
+    sql += " ORDER BY h.date_added DESC, h.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return _query(conn, _highlight_row, sql, params)
+
+def get_highlights_for_book(conn, book_id, limit=None, after=None):
+    """Return a book's highlights, newest first. See iter_highlights_for_book."""
+    return list(iter_highlights_for_book(conn, book_id, limit, after))
+
+def get_highlights_for_book_page(conn, book_id, cursor=None, limit=PAGE_SIZE):
+    """Return one page of a book's highlights (with tags) and the cursor for the next page, or None."""
+    highlights = get_highlights_for_book(conn, book_id, limit=limit + 1, after=decode_cursor(cursor))
+    highlights, next_cursor = _paginate(highlights, limit, lambda h: (h.date_added, h.id))
+    attach_tags(conn, highlights)
+    return highlights, next_cursor
+
+def get_book_by_id(conn, book_id):
+    return _query(conn, _book_row, f"SELECT {BOOK_COLUMNS} FROM books b WHERE b.id = ?", (book_id,)).fetchone()
+
+def parse_search_terms(query):
+    """Split a user search string into (term, is_phrase) pairs.
+
+    Text wrapped in double quotes is a phrase; everything else is split on
+    whitespace. Terms without any word characters are dropped.
+    """
+    terms = []
+    for match in re.finditer(r'"([^"]*)"?|(\S+)', query):
+        phrase, word = match.group(1), match.group(2)
+        term = phrase if phrase is not None else word
+        if re.search(r'\w', term):
+            terms.append((term, phrase is not None))
+    return terms
+
+def build_fts_query(query):
+    """Translate a user search string into an FTS5 MATCH expression.
+
+    Phrases become phrase queries; every other word is a prefix query. All
+    parts must match. Returns None if nothing searchable is left.
+    """
+    parts = []
+    for term, is_phrase in parse_search_terms(query):
+        escaped = '"' + term.replace('"', '""') + '"'
+        parts.append(escaped if is_phrase else escaped + '*')
+    return ' AND '.join(parts) if parts else None
+
+def _search(conn, query, limit=None, after=None):
+    """Run a full-text search, returning (highlight, book, rank) rows, best match first."""
+    fts_query = build_fts_query(query)
+    if fts_query is None:
+        return []
+    return _match(conn, fts_query, limit, after)
+
+def _match(conn, fts_query, limit=None, after=None):
+    """Return (highlight, book, rank) rows for an FTS5 MATCH expression, best match first."""
+    sql = f"""
+        SELECT {HIGHLIGHT_COLUMNS}, {BOOK_COLUMNS}, highlights_fts.rank
+        FROM highlights_fts
+        JOIN highlights h ON h.id = highlights_fts.rowid
         JOIN books b ON h.book_id = b.id
-        WHERE h.quote LIKE ? OR b.title LIKE ? OR b.author LIKE ?
-        ORDER BY h.date_added DESC
-    """, (like_query, like_query, like_query))
-    results = cursor.fetchall()
-    
-    search_results = []
-    for row in results:
-        highlight = Highlight(
-            id=row[0],
-            book_id=row[6],  # b.id
-            highlight_type=row[1],
-            page=row[2],
-            location=row[3],
-            date_added=row[4],
-            quote=row[5]
-        )
-        book = Book(id=row[6], title=row[7], author=row[8])
-        search_results.append((highlight, book))
-    
-    return search_results
+        WHERE highlights_fts MATCH ?
+    """
+    params = [fts_query]
+    if after:
+        sql += " AND (highlights_fts.rank > ? OR (highlights_fts.rank = ? AND h.id < ?))"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY highlights_fts.rank, h.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return _query(conn, _search_row, sql, params).fetchall()
+
+def search_highlights(conn, query, limit=None, after=None):
+    """Full-text search over quotes, titles and authors, ordered by bm25 relevance.
+
+    ``after`` is the (rank, id) key of the last result already seen, for
+    keyset pagination.
+    """
+    return [(highlight, book) for highlight, book, _ in _search(conn, query, limit, after)]
+
+def search_highlights_page(conn, query, cursor=None, limit=PAGE_SIZE):
+    """Return one page of search results (with tags) and the cursor for the next page, or None."""
+    results = _search(conn, query, limit=limit + 1, after=decode_cursor(cursor))
+    results, next_cursor = _paginate(results, limit, lambda r: (r[2], r[0].id))
+    results = [(highlight, book) for highlight, book, _ in results]
+    attach_tags(conn, [highlight for highlight, _ in results])
+    return results, next_cursor
+
+# Words shorter than this are neither corrected nor offered as corrections
+MIN_FUZZY_WORD = 3
+# Least trigram similarity for an indexed word to count as a spelling of a search word
+FUZZY_SIMILARITY = 0.3
+# Indexed words considered per search word: the best trigram matches, plus
+# words with the same first two letters (which catches swapped letters in
+# short words), and how many of them are kept
+FUZZY_CANDIDATES = 50
+FUZZY_PREFIX_CANDIDATES = 200
+FUZZY_ALTERNATIVES = 5
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+def _strip_diacritics(word):
+    if word.isascii():
+        return word
+    return ''.join(c for c in unicodedata.normalize('NFKD', word) if not unicodedata.combining(c))
+
+def search_words(text):
+    """Split text into lowercase words without diacritics, as the search index tokenizes it."""
+    return [_strip_diacritics(word) for word in WORD_RE.findall(text.lower())]
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def trigram_similarity(a, b):
+    """Share of the two words' trigrams (padded, so the start of a word counts most) they have in common."""
+    a, b = _trigrams(a), _trigrams(b)
+    return len(a & b) / len(a | b)
+
+def edit_distance(a, b):
+    """Optimal string alignment distance: insertions, deletions, substitutions and swaps of adjacent letters."""
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, b_char in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a_char != b_char))
+            if i > 1 and j > 1 and a_char == b[j - 2] and a[i - 2] == b_char:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        before_previous, previous = previous, current
+    return previous[-1]
+
+def suggest_terms(conn, word):
+    """Return up to FUZZY_ALTERNATIVES indexed words spelled like word, closest first.
+
+    The trigram index finds the words sharing most three-letter substrings
+    with it. A candidate counts as a spelling if it is at most one edit away
+    (two for words over five letters) or similar enough by trigrams, and
+    its length is not too far off.
+    """
+    substrings = sorted({word[i:i + 3] for i in range(len(word) - 2)})
+    if not substrings:
+        return []
+    slack = max(2, len(word) // 3)
+    candidates = {term for term, in conn.execute("""
+        SELECT term FROM search_terms_trigram
+        WHERE search_terms_trigram MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """, (' OR '.join(f'"{s}"' for s in substrings), FUZZY_CANDIDATES))}
+    candidates.update(term for term, in conn.execute("""
+        SELECT term FROM search_terms
+        WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?
+        LIMIT ?
+    """, (word[:2], word[:2] + '\uffff', len(word) - slack, len(word) + slack, FUZZY_PREFIX_CANDIDATES)))
+    max_edits = 1 if len(word) <= 5 else 2
+    scored = []
+    for term in candidates:
+        if abs(len(term) - len(word)) > slack:
+            continue
+        edits, similarity = edit_distance(word, term), trigram_similarity(word, term)
+        if edits <= max_edits or similarity >= FUZZY_SIMILARITY:
+            scored.append((edits, -similarity, term))
+    return [term for _, _, term in sorted(scored)[:FUZZY_ALTERNATIVES]]
+
+def fuzzy_search_highlights(conn, query, limit=PAGE_SIZE):
+    """Typo-tolerant search, for when the exact search finds nothing.
+
+    Every word of the query is replaced by the indexed words spelled like
+    it. Highlights matching a spelling of every word come first; if there
+    are none, those matching any of them, ranked by bm25. Returns
+    (results, corrections): up to limit (highlight, book) pairs with tags,
+    and the words searched for instead, joined by spaces (None if no word
+    had a close spelling).
+    """
+    groups = []
+    for term, _ in parse_search_terms(query):
+        for word in search_words(term):
+            if len(word) >= MIN_FUZZY_WORD and (alternatives := suggest_terms(conn, word)):
+                groups.append(alternatives)
+    if not groups:
+        return [], None
+    results = []
+    for operator in (' AND ', ' OR '):
+        fts_query = operator.join('(' + ' OR '.join(f'"{term}"' for term in alternatives) + ')' for alternatives in groups)
+        results = [(highlight, book) for highlight, book, _ in _match(conn, fts_query, limit)]
+        if results:
+            break
+    attach_tags(conn, [highlight for highlight, _ in results])
+    return results, ' '.join(term for alternatives in groups for term in alternatives)
+
+def _add_search_terms(cursor, texts):
+    """Add the words of texts to search_terms, for spelling corrections."""
+    # A batch repeats the same words many times over, so the regex only sees
+    # each distinct whitespace-separated chunk once
+    chunks = set(' '.join(text for text in texts if text).lower().split())
+    words = set(WORD_RE.findall(' '.join(chunks)))
+    words = {_strip_diacritics(word) for word in words if len(word) >= MIN_FUZZY_WORD}
+    cursor.executemany("INSERT OR IGNORE INTO search_terms (term) VALUES (?)", ((word,) for word in words))
 
 def insert_book(conn, title, author):
     cursor = conn.cursor()
@@ -172,33 +734,276 @@ def insert_highlight(conn, book_id, highlight_type, page, location, date_added,
     """, (book_id, highlight_type, page, location, date_added, quote))
     return cursor.lastrowid
 
+IMPORT_BATCH_SIZE = 5000
+
+def location_range(location):
+    """Parse a Kindle location such as '6982-6984' or '1234' into a (start, end) tuple, or None."""
+    if not location:
+        return None
+    start, _, end = location.partition('-')
+    try:
+        return int(start), int(end or start)
+    except ValueError:
+        return None
+
+def _load_location_index(cursor, book_id):
+    """Load a book's highlight ranges as an interval index (see _index_insert).
+
+    Rows whose location is not a plain range, such as notebook highlights,
+    are left out, as they are on import.
+    """
+    cursor.execute("""
+        SELECT loc_start, loc_end, location, date_added, quote
+        FROM highlights
+        WHERE book_id = ? AND highlight_type = 'Highlight' AND loc_start IS NOT NULL
+        ORDER BY loc_start
+    """, (book_id,))
+    index = ([], [], [])
+    for row in cursor.fetchall():
+        if location_range(row[2]) is None:
+            continue
+        _index_insert(index, (row[0], row[1], row[2], row[3] or '', row[4] or ''))
+    return index
+
+def _index_insert(index, interval):
+    """Add a (start, end, location, date, quote) interval to an index.
+
+    The index is three parallel lists sorted by start: the starts, the
+    intervals, and the largest end of any interval up to each position. The
+    ranges may overlap, since neighbouring highlights often share a location.
+    """
+    starts, intervals, max_ends = index
+    start, end = interval[0], interval[1]
+    position = bisect.bisect_right(starts, start)
+    starts.insert(position, start)
+    intervals.insert(position, interval)
+    max_ends.insert(position, max(max_ends[position - 1], end) if position else end)
+    for i in range(position + 1, len(max_ends)):
+        if max_ends[i] >= end:
+            break
+        max_ends[i] = end
+
+def _index_remove(index, position):
+    """Remove the interval at position from an index, then fix up the running largest ends after it."""
+    starts, intervals, max_ends = index
+    del starts[position], intervals[position], max_ends[position]
+    running = max_ends[position - 1] if position else None
+    for i in range(position, len(max_ends)):
+        end = intervals[i][1] if running is None else max(running, intervals[i][1])
+        if end == max_ends[i]:
+            break
+        max_ends[i] = running = end
+
+def _find_overlaps(index, start, end):
+    """Return positions (highest first) of the intervals in the index overlapping [start, end].
+
+    Bisect to the last interval starting at or before ``end`` and walk back
+    while some interval at or before the position still reaches ``start``.
+    """
+    starts, intervals, max_ends = index
+    position = bisect.bisect_right(starts, end) - 1
+    overlaps = []
+    while position >= 0 and max_ends[position] >= start:
+        if intervals[position][1] >= start:
+            overlaps.append(position)
+        position -= 1
+    return overlaps
+
+def _normalize_quote(quote):
+    return ' '.join(quote.split()).casefold()
+
+def _same_passage(quote, existing_quote):
+    """Whether two quotes at overlapping locations are one highlight, e.g. extended or trimmed.
+
+    One must contain the other, or they must share a prefix or suffix at
+    least half as long as the shorter one. Neighbouring sentences that only
+    share a location are not the same passage.
+    """
+    a, b = _normalize_quote(quote), _normalize_quote(existing_quote)
+    if a in b or b in a:
+        return True
+    shortest = min(len(a), len(b))
+    prefix = len(os.path.commonprefix([a, b]))
+    suffix = len(os.path.commonprefix([a[::-1], b[::-1]]))
+    return max(prefix, suffix) * 2 >= shortest
+
+def _supersedes(start, end, date_key, existing):
+    """Whether a new highlight replaces an overlapping one: it is newer, or as new and strictly wider."""
+    existing_start, existing_end, _, existing_date, _ = existing
+    if date_key != existing_date:
+        return date_key > existing_date
+    return start <= existing_start and end >= existing_end and (start, end) != (existing_start, existing_end)
+
+def _location_taken(cursor, book_id, location, queued):
+    """Whether the book already has a highlight at location, stored or queued in the current batch."""
+    if (book_id, location) in queued:
+        return True
+    cursor.execute("SELECT 1 FROM highlights WHERE book_id = ? AND location = ?", (book_id, location))
+    return cursor.fetchone() is not None
+
+def _collapse_into(cursor, book_id, kept_location, obsolete_locations, row):
+    """Overwrite the highlight at kept_location with row, folding the obsolete ones (and their tags) into it."""
+    cursor.execute("SELECT id FROM highlights WHERE book_id = ? AND location = ?", (book_id, kept_location))
+    kept_id = cursor.fetchone()[0]
+    if obsolete_locations:
+        placeholders = ', '.join('?' * len(obsolete_locations))
+        cursor.execute(f"SELECT id FROM highlights WHERE book_id = ? AND location IN ({placeholders})", [book_id] + obsolete_locations)
+        obsolete_ids = [r[0] for r in cursor.fetchall()]
+        placeholders = ', '.join('?' * len(obsolete_ids))
+        cursor.execute(f"UPDATE OR IGNORE highlight_tags SET highlight_id = ? WHERE highlight_id IN ({placeholders})", [kept_id] + obsolete_ids)
+        cursor.execute(f"DELETE FROM highlight_tags WHERE highlight_id IN ({placeholders})", obsolete_ids)
+        cursor.execute(f"DELETE FROM highlights WHERE id IN ({placeholders})", obsolete_ids)
+    cursor.execute("""
+        UPDATE highlights SET highlight_type = ?, page = ?, location = ?, date_added = ?, quote = ?, color = ?, note = ?
+        WHERE id = ?
+    """, row[1:] + (kept_id,))
+
+def import_highlights(conn, entries, since=None, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Bulk import an iterable of (Book, Highlight) pairs in a single transaction.
+
+    Book ids are resolved through a (title, author) -> id map loaded once up
+    front, and highlights are written with executemany in batches. Entries
+    dated on or before ``since`` are skipped, as are duplicates of existing
+    highlights.
+
+    Extending a highlight on a Kindle appends a new clipping whose location
+    range overlaps the old one. Overlapping highlights of the same passage
+    (see _same_passage) are collapsed into the newest one, keeping the
+    existing row's id and tags. Highlights that only share a location with
+    a neighbour are kept, and so is the old highlight when the new one's
+    location already belongs to a different one. Overlaps are found with a
+    per-book sorted interval index, so each lookup is a bisection.
+
+    If given, ``progress`` is called with the running (inserted, skipped)
+    counts after each batch is written.
+
+    Returns an (inserted, skipped) tuple; highlights that replaced an older
+    overlapping one count as inserted.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, title, author FROM books")
+    book_ids = {(row[1], row[2]): row[0] for row in cursor.fetchall()}
+    new_books = set()
+    location_indexes = {}
+    pending = {}  # (book_id, location) -> position in batch, for rows not yet written
+    queued = set()  # (book_id, location) of every row in the batch
+    inserted = 0
+    skipped = 0
+    batch = []
+    with conn:
+        for book, highlight in entries:
+            if since and highlight.date_added and highlight.date_added <= since:
+                skipped += 1
+                continue
+            key = (book.title, book.author)
+            book_id = book_ids.get(key)
+            if book_id is None:
+                cursor.execute("INSERT INTO books (title, author) VALUES (?, ?)", key)
+                book_id = book_ids[key] = cursor.lastrowid
+                new_books.add(book_id)
+                _add_search_terms(cursor, key)
+            row = (book_id, highlight.highlight_type, highlight.page, highlight.location, highlight.date_added, highlight.quote,
+                   highlight.color, highlight.note)
+            bounds = location_range(highlight.location) if highlight.highlight_type == 'Highlight' else None
+            if bounds is None:
+                batch.append(row)
+                queued.add((book_id, highlight.location))
+            else:
+                if book_id not in location_indexes:
+                    location_indexes[book_id] = ([], [], []) if book_id in new_books else _load_location_index(cursor, book_id)
+                index = location_indexes[book_id]
+                intervals = index[1]
+                start, end = bounds
+                date_key = highlight.date_added or ''
+                quote = highlight.quote or ''
+                overlaps = [i for i in _find_overlaps(index, start, end) if _same_passage(quote, intervals[i][4])]
+                if not all(_supersedes(start, end, date_key, intervals[i]) for i in overlaps):
+                    skipped += 1
+                    continue
+                if (overlaps and highlight.location not in {intervals[i][2] for i in overlaps}
+                        and _location_taken(cursor, book_id, highlight.location, queued)):
+                    # Replacing the old highlight would collide with the one already there
+                    skipped += 1
+                    continue
+                kept_location = None
+                obsolete_locations = []
+                for position in overlaps:
+                    location = intervals[position][2]
+                    _index_remove(index, position)
+                    batch_position = pending.pop((book_id, location), None)
+                    if batch_position is not None:
+                        batch[batch_position] = None
+                        queued.discard((book_id, location))
+                        skipped += 1
+                    elif kept_location is None:
+                        kept_location = location
+                    else:
+                        obsolete_locations.append(location)
+                if kept_location is None:
+                    pending[(book_id, highlight.location)] = len(batch)
+                    batch.append(row)
+                    queued.add((book_id, highlight.location))
+                else:
+                    _collapse_into(cursor, book_id, kept_location, obsolete_locations, row)
+                    _add_search_terms(cursor, [highlight.quote])
+                    inserted += 1
+                _index_insert(index, (start, end, highlight.location, date_key, quote))
+            if len(batch) >= batch_size:
+                added, ignored = _insert_highlight_batch(cursor, batch)
+                inserted += added
+                skipped += ignored
+                batch = []
+                pending.clear()
+                queued.clear()
+                if progress:
+                    progress(inserted, skipped)
+        if batch:
+            added, ignored = _insert_highlight_batch(cursor, batch)
+            inserted += added
+            skipped += ignored
+        if progress:
+            progress(inserted, skipped)
+        if inserted or new_books:
+            bump_generation(cursor)
+    return inserted, skipped
+
+def _insert_highlight_batch(cursor, batch):
+    """Write the batch, leaving out rows superseded while queued. Returns (inserted, ignored) counts."""
+    rows = [row for row in batch if row is not None]
+    cursor.executemany("""
+        INSERT OR IGNORE INTO highlights 
+        (book_id, highlight_type, page, location, date_added, quote, color, note) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    inserted = cursor.rowcount
+    _add_search_terms(cursor, [row[5] for row in rows])
+    return inserted, len(rows) - inserted
+
 # Tag functions
 def get_all_tags(conn):
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM tags ORDER BY name")
-    results = cursor.fetchall()
-    
-    tags = []
-    for row in results:
-        tag = Tag(id=row[0], name=row[1])
-        tags.append(tag)
-    
-    return tags
+    return _query(conn, _tag_row, f"SELECT {TAG_COLUMNS} FROM tags t ORDER BY t.name").fetchall()
+
+def get_tags_with_counts(conn):
+    """Return all tags ordered by name, each with highlight_count set, in one aggregate query."""
+    return _query(conn, _tag_row, f"""
+        SELECT {TAG_COLUMNS}, COUNT(ht.tag_id)
+        FROM tags t
+        LEFT JOIN highlight_tags ht ON ht.tag_id = t.id
+        GROUP BY t.id
+        ORDER BY t.name
+    """).fetchall()
 
 def get_tag_by_id(conn, tag_id):
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM tags WHERE id = ?", (tag_id,))
-    row = cursor.fetchone()
-    if row:
-        return Tag(id=row[0], name=row[1])
-    return None
+    return _query(conn, _tag_row, f"SELECT {TAG_COLUMNS} FROM tags t WHERE t.id = ?", (tag_id,)).fetchone()
 
 def insert_tag(conn, name):
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO tags (name) VALUES (?)", (name,))
+        tag_id = cursor.lastrowid
+        bump_generation(cursor)
         conn.commit()
-        return cursor.lastrowid
+        return tag_id
     except sqlite3.IntegrityError:
         # Tag name already exists
         return None
@@ -207,8 +1012,11 @@ def update_tag(conn, tag_id, name):
     cursor = conn.cursor()
     try:
         cursor.execute("UPDATE tags SET name = ? WHERE id = ?", (name, tag_id))
+        updated = cursor.rowcount > 0
+        if updated:
+            bump_generation(cursor)
         conn.commit()
-        return cursor.rowcount > 0
+        return updated
     except sqlite3.IntegrityError:
         # Name conflict
         return False
@@ -219,30 +1027,50 @@ def delete_tag(conn, tag_id):
     cursor.execute("DELETE FROM highlight_tags WHERE tag_id = ?", (tag_id,))
     # Then delete the tag
     cursor.execute("DELETE FROM tags WHERE id = ?", (tag_id,))
+    deleted = cursor.rowcount > 0  # This will be True if the tag was deleted
+    if deleted:
+        bump_generation(cursor)
     conn.commit()
-    return cursor.rowcount > 0  # This will be True if the tag was deleted
+    return deleted
 
 # Highlight-Tag functions
 def get_tags_for_highlight(conn, highlight_id):
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT t.id, t.name
+    return _query(conn, _tag_row, f"""
+        SELECT {TAG_COLUMNS}
         FROM tags t
         JOIN highlight_tags ht ON t.id = ht.tag_id
         WHERE ht.highlight_id = ?
         ORDER BY t.name
-    """, (highlight_id,))
-    results = cursor.fetchall()
-    tags = []
-    for row in results:
-        tag = Tag(id=row[0], name=row[1])
-        tags.append(tag)
-    return tags
+    """, (highlight_id,)).fetchall()
+
+def get_tags_for_highlights(conn, highlight_ids):
+    """Return a dict mapping each highlight id to its tags, using a single query."""
+    tags_by_highlight = {highlight_id: [] for highlight_id in highlight_ids}
+    if not tags_by_highlight:
+        return tags_by_highlight
+    cursor = _query(conn, lambda cursor, row: (row[0], Tag(*row[1:])), f"""
+        SELECT ht.highlight_id, {TAG_COLUMNS}
+        FROM highlight_tags ht
+        JOIN tags t ON t.id = ht.tag_id
+        WHERE ht.highlight_id IN (SELECT value FROM json_each(?))
+        ORDER BY t.name
+    """, (json.dumps(list(tags_by_highlight)),))
+    for highlight_id, tag in cursor:
+        tags_by_highlight[highlight_id].append(tag)
+    return tags_by_highlight
+
+def attach_tags(conn, highlights):
+    """Set the tags attribute on every highlight in the list with one query."""
+    tags_by_highlight = get_tags_for_highlights(conn, [h.id for h in highlights])
+    for highlight in highlights:
+        highlight.tags = tags_by_highlight[highlight.id]
+    return highlights
 
 def add_tag_to_highlight(conn, highlight_id, tag_id):
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO highlight_tags (highlight_id, tag_id) VALUES (?, ?)", (highlight_id, tag_id))
+        bump_generation(cursor)
         conn.commit()
         return True
     except sqlite3.IntegrityError:
@@ -252,64 +1080,117 @@ def add_tag_to_highlight(conn, highlight_id, tag_id):
 def remove_tag_from_highlight(conn, highlight_id, tag_id):
     cursor = conn.cursor()
     cursor.execute("DELETE FROM highlight_tags WHERE highlight_id = ? AND tag_id = ?", (highlight_id, tag_id))
+    removed = cursor.rowcount > 0
+    if removed:
+        bump_generation(cursor)
     conn.commit()
-    return cursor.rowcount > 0
+    return removed
+
+def set_tags_for_highlight(conn, highlight_id, tag_ids):
+    """Replace the tags of a highlight in one transaction."""
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM highlight_tags WHERE highlight_id = ?", (highlight_id,))
+        cursor.executemany("INSERT OR IGNORE INTO highlight_tags (highlight_id, tag_id) VALUES (?, ?)",
+                           [(highlight_id, tag_id) for tag_id in tag_ids])
+        bump_generation(cursor)
 
 def get_highlights_for_book_with_tags(conn, book_id):
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT h.id, h.highlight_type, h.page, h.location, h.date_added, h.quote
-        FROM highlights h
-        WHERE h.book_id = ?
-        ORDER BY h.date_added DESC
-    """, (book_id,))
-    results = cursor.fetchall()
-    
-    highlights = []
-    for row in results:
-        highlight = Highlight(
-            id=row[0],
-            book_id=book_id,
-            highlight_type=row[1],
-            page=row[2],
-            location=row[3],
-            date_added=row[4],
-            quote=row[5]
-        )
-        # Add tags
-        highlight.tags = get_tags_for_highlight(conn, highlight.id)
-        highlights.append(highlight)
-    
-    return highlights
+    return attach_tags(conn, get_highlights_for_book(conn, book_id))
 
-def get_highlights_for_tag(conn, tag_id):
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT h.id, h.highlight_type, h.page, h.location, h.date_added, h.quote, b.title, b.author
+def iter_highlights_for_tag(conn, tag_id):
+    """Yield (highlight, book) pairs for a tag, newest first, as they are read. Tags are not loaded."""
+    return _query(conn, _highlight_book_row, f"""
+        SELECT {HIGHLIGHT_COLUMNS}, {BOOK_COLUMNS}
         FROM highlights h
         JOIN highlight_tags ht ON h.id = ht.highlight_id
         JOIN books b ON h.book_id = b.id
         WHERE ht.tag_id = ?
         ORDER BY h.date_added DESC
     """, (tag_id,))
-    results = cursor.fetchall()
-    
-    highlights = []
-    for row in results:
-        highlight = Highlight(
-            id=row[0],
-            book_id=None,  # We don't need book_id here since we're getting book info separately
-            highlight_type=row[1],
-            page=row[2],
-            location=row[3],
-            date_added=row[4],
-            quote=row[5]
-        )
-        # Add tags
-        highlight.tags = get_tags_for_highlight(conn, highlight.id)
-        # Add book info
-        book = Book(title=row[6], author=row[7])
-        highlights.append((highlight, book))
-    
+
+def get_highlights_for_tag(conn, tag_id):
+    highlights = list(iter_highlights_for_tag(conn, tag_id))
+    attach_tags(conn, [h for h, _ in highlights])
+    return highlights
+
+def get_highlights_by_ids(conn, highlight_ids):
+    """Return (highlight, book) pairs with tags for the given ids, in the order given. Unknown ids are left out."""
+    cursor = _query(conn, _highlight_book_row, f"""
+        SELECT {HIGHLIGHT_COLUMNS}, {BOOK_COLUMNS}
+        FROM highlights h
+        JOIN books b ON h.book_id = b.id
+        WHERE h.id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(highlight_ids)),))
+    by_id = {highlight.id: (highlight, book) for highlight, book in cursor}
+    highlights = [by_id[highlight_id] for highlight_id in highlight_ids if highlight_id in by_id]
+    attach_tags(conn, [h for h, _ in highlights])
     return highlights
+
+def iter_highlight_quotes(conn, after_id=0):
+    """Yield (id, quote) for every highlight with an id above after_id, in id order."""
+    return conn.execute("SELECT id, quote FROM highlights WHERE id > ? ORDER BY id", (after_id,))
+
+def get_highlight_quotes(conn, highlight_ids):
+    """Return (id, quote) pairs for those of the given highlight ids that still exist."""
+    return conn.execute(
+        "SELECT id, quote FROM highlights WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(highlight_ids)),),
+    ).fetchall()
+
+def get_highlight_changes(conn, after_seq=0):
+    """Return (last_seq, ids) for highlights changed or deleted since the change numbered after_seq."""
+    rows = conn.execute("SELECT seq, highlight_id FROM highlight_changes WHERE seq > ? ORDER BY seq", (after_seq,)).fetchall()
+    if not rows:
+        return after_seq, set()
+    return rows[-1][0], {highlight_id for _, highlight_id in rows}
+
+def prune_highlight_changes(conn, through_seq):
+    """Forget changes up to and including through_seq, once every index has applied them."""
+    conn.execute("DELETE FROM highlight_changes WHERE seq <= ?", (through_seq,))
+    conn.commit()
+
+EXPORT_BATCH_SIZE = 500
+
+def iter_library(conn, book_id=None, tag_id=None, since=None, before=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield (highlight, book) pairs with tags for the whole library, or the part matching the filters.
+
+    Books come in title order and each book's highlights oldest first.
+    ``since`` (inclusive) and ``before`` (exclusive) are ISO dates or
+    datetimes compared against date_added. Each book's highlights are read
+    from its own cursor in (book_id, date_added) index order, so nothing is
+    sorted, and tags are loaded ``batch_size`` highlights at a time: memory
+    use does not grow with the library.
+    """
+    book_sql = f"SELECT {BOOK_COLUMNS} FROM books b"
+    book_params = []
+    if book_id is not None:
+        book_sql += " WHERE b.id = ?"
+        book_params.append(book_id)
+    book_sql += " ORDER BY b.title, b.author"
+    books = _query(conn, _book_row, book_sql, book_params).fetchall()
+
+    sql = f"SELECT {HIGHLIGHT_COLUMNS} FROM highlights h WHERE h.book_id = ?"
+    filters = []
+    if tag_id is not None:
+        sql += " AND h.id IN (SELECT highlight_id FROM highlight_tags WHERE tag_id = ?)"
+        filters.append(tag_id)
+    if since:
+        sql += " AND h.date_added >= ?"
+        filters.append(since)
+    if before:
+        sql += " AND h.date_added < ?"
+        filters.append(before)
+    sql += " ORDER BY h.date_added, h.id"
+
+    batch = []
+    for book in books:
+        for highlight in _query(conn, _highlight_row, sql, [book.id] + filters):
+            batch.append((highlight, book))
+            if len(batch) >= batch_size:
+                attach_tags(conn, [h for h, _ in batch])
+                yield from batch
+                batch = []
+    attach_tags(conn, [h for h, _ in batch])
+    yield from batch
     
\ No newline at end of file
@@ -0,0 +1,139 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+from database import connect, create_tables, iter_library
+from config import DB_PATH
+
+# Formatted text is handed out in chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+CSV_FIELDS = ['id', 'book', 'author', 'highlight_type', 'page', 'location', 'date_added', 'quote', 'color', 'note', 'tags']
+
+
+def _chunked(pieces, chunk_size=CHUNK_SIZE):
+    """Join an iterable of strings into chunks of at least chunk_size characters."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def _tag_names(highlight):
+    return [tag.name for tag in highlight.tags]
+
+def iter_csv(entries):
+    """Yield CSV text for (highlight, book) pairs, header first, a line at a time."""
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def render(row):
+        line.seek(0)
+        line.truncate()
+        writer.writerow(row)
+        return line.getvalue()
+
+    yield render(CSV_FIELDS)
+    for highlight, book in entries:
+        yield render([highlight.id, book.title, book.author, highlight.highlight_type, highlight.page, highlight.location,
+                      highlight.date_added, highlight.quote, highlight.color, highlight.note, '; '.join(_tag_names(highlight))])
+
+def iter_ndjson(entries):
+    """Yield one JSON object per line for (highlight, book) pairs."""
+    for highlight, book in entries:
+        yield json.dumps({
+            'id': highlight.id,
+            'book': {'id': book.id, 'title': book.title, 'author': book.author},
+            'highlight_type': highlight.highlight_type,
+            'page': highlight.page,
+            'location': highlight.location,
+            'date_added': highlight.date_added,
+            'quote': highlight.quote,
+            'color': highlight.color,
+            'note': highlight.note,
+            'tags': _tag_names(highlight),
+        }, ensure_ascii=False) + '\n'
+
+def iter_markdown(entries):
+    """Yield Markdown with a section per book, for (highlight, book) pairs grouped by book."""
+    current_book = None
+    for highlight, book in entries:
+        if (book.id, book.title, book.author) != current_book:
+            if current_book is not None:
+                yield '\n'
+            current_book = (book.id, book.title, book.author)
+            yield f"## {book.title}\n\n"
+            if book.author:
+                yield f"*{book.author}*\n\n"
+        quote = '\n> '.join(highlight.quote.splitlines() or [''])
+        details = [highlight.highlight_type or 'Highlight']
+        if highlight.page is not None:
+            details.append(f"page {highlight.page}")
+        if highlight.location:
+            details.append(f"location {highlight.location}")
+        if highlight.date_added:
+            details.append(f"added {highlight.date_added[:10]}")
+        tags = ' '.join(f"`{name}`" for name in _tag_names(highlight))
+        yield f"> {quote}\n\n— {', '.join(details)}{' ' + tags if tags else ''}\n\n"
+        if highlight.note:
+            yield f"{highlight.note}\n\n"
+
+# format name -> (renderer, mimetype, file extension)
+FORMATS = {
+    'csv': (iter_csv, 'text/csv', 'csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson', 'ndjson'),
+    'markdown': (iter_markdown, 'text/markdown', 'md'),
+}
+
+def parse_date_filter(value):
+    """Check a --since/--before value is an ISO date or datetime and return it in date_added's format, or None."""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value).isoformat()
+
+def export_library(conn, fmt, book_id=None, tag_id=None, since=None, before=None):
+    """Yield the library, or the part matching the filters, as text chunks in the given format.
+
+    Raises ValueError for an unknown format or a malformed date.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    render = FORMATS[fmt][0]
+    entries = iter_library(conn, book_id, tag_id, parse_date_filter(since), parse_date_filter(before))
+    return _chunked(render(entries), CHUNK_SIZE)
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Export highlights from the BookMarker database.")
+    arg_parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    arg_parser.add_argument('--book-id', type=int, help="only this book's highlights")
+    arg_parser.add_argument('--tag-id', type=int, help="only highlights with this tag")
+    arg_parser.add_argument('--since', help="only highlights added on or after this ISO date")
+    arg_parser.add_argument('--before', help="only highlights added before this ISO date")
+    arg_parser.add_argument('--output', help="file to write (default: standard output)")
+    return arg_parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    conn = connect(DB_PATH)
+    create_tables(conn)
+    try:
+        chunks = export_library(conn, args.format, args.book_id, args.tag_id, args.since, args.before)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
+    except ValueError as e:
+        sys.exit(f"export: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,86 @@
 import sys
-from database import create_tables, get_last_import_date, set_last_import_date, insert_book, insert_highlight
-from parser import parse_clippings
+import os
+import argparse
+import hashlib
+from database import connect, create_tables, get_last_import_date, set_last_import_date, import_highlights, get_import_checkpoint, set_import_checkpoint
+from parser import iter_clippings, iter_clippings_parallel, last_entry_boundary
+from related import update_index
 from app.models import Book, Highlight
 from config import DB_PATH, CLIPPINGS_FILE
 import sqlite3
 import datetime
 
+# Bytes hashed at each end of the imported prefix to recognise the same file
+FINGERPRINT_WINDOW = 64 * 1024
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
-    create_tables(conn)
 
-    last_import_date = get_last_import_date(conn)
-    print(f"Last import date: {last_import_date}")
+def prefix_fingerprint(f, offset):
+    """Hash the first and last FINGERPRINT_WINDOW bytes of the first ``offset`` bytes of f.
+
+    Hashing the whole prefix would cost as much as re-reading the file, so
+    the two windows plus the length stand in for it.
+    """
+    digest = hashlib.sha256(str(offset).encode('ascii'))
+    f.seek(0)
+    digest.update(f.read(min(offset, FINGERPRINT_WINDOW)))
+    tail_start = max(offset - FINGERPRINT_WINDOW, 0)
+    f.seek(tail_start)
+    digest.update(f.read(offset - tail_start))
+    return digest.hexdigest()
+
+def import_clippings(conn, path, workers=1):
+    """Import a Kindle clippings file, resuming after the last imported entry when possible.
 
-    with open(CLIPPINGS_FILE, 'r', encoding='utf-8-sig') as f:
-        text = f.read()
+    Kindle only appends to My Clippings.txt, so the byte offset of the last
+    complete entry is saved along with a fingerprint of everything before it.
+    If the fingerprint still matches, only the appended tail is parsed;
+    otherwise the whole file is imported again (duplicates are ignored).
+    With ``workers`` > 1 the file is parsed by that many processes.
+    Returns (inserted, skipped, start_offset).
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        start = 0
+        checkpoint = get_import_checkpoint(conn)
+        if checkpoint and checkpoint['offset'] <= size and prefix_fingerprint(f, checkpoint['offset']) == checkpoint['prefix_hash']:
+            start = checkpoint['offset']
+        # Anything after the last separator may still be incomplete, so the
+        # checkpoint stops there and that fragment is parsed again next time
+        boundary = last_entry_boundary(f, size)
+        if workers > 1:
+            entries = iter_clippings_parallel(path, workers, start=start)
+        else:
+            f.seek(start)
+            entries = iter_clippings(f)
+        inserted, skipped = import_highlights(conn, entries)
+        set_import_checkpoint(conn, size, boundary, prefix_fingerprint(f, boundary))
+    return inserted, skipped, start
 
-    parsed_entries = parse_clippings(text)
-    if last_import_date:
-        parsed_entries = [e for e in parsed_entries if not e[1].date_added or e[1].date_added > last_import_date]
-    print(f"Parsed {len(parsed_entries)} entries.")
 
-    for book, highlight in parsed_entries:
-        # Insert or get book
-        book_id = insert_book(conn, book.title, book.author)
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Import Kindle clippings into the BookMarker database.")
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help="number of processes used to parse the clippings file (default: 1)")
+    return arg_parser.parse_args(argv)
 
-        # Insert highlight
-        insert_highlight(conn, book_id, highlight.highlight_type, highlight.page, highlight.location, highlight.date_added, highlight.quote)
+def main(argv=None):
+    args = parse_args(argv)
+    conn = connect(DB_PATH)
+    create_tables(conn)
+
+    last_import_date = get_last_import_date(conn)
+    print(f"Last import date: {last_import_date}")
 
-    conn.commit()
+    inserted, skipped, start = import_clippings(conn, CLIPPINGS_FILE, workers=args.workers)
+    if start:
+        print(f"Resumed import at byte {start}.")
+    print(f"Parsed {inserted + skipped} entries, imported {inserted} new highlights.")
 
     # Update last import date
     now_iso = datetime.datetime.now().isoformat()
     set_last_import_date(conn, now_iso)
     print(f"Import completed at {now_iso}")
+    print(f"Related highlights index holds {update_index(conn, DB_PATH)} highlights.")
 
     conn.close()
 
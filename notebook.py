@@ -0,0 +1,227 @@
+"""Offline import of Kindle notebook data (read.amazon.com/notebook).
+
+Two sources share one schema: the highlights.json written by
+scraper_old/basic_selenium.py, and notebook pages saved from the browser,
+which parse_notebook_html reads with the standard library's HTML parser:
+
+    {title: {"author", "last_accessed", "image_url",
+             "highlights": [{"text", "color", "location_type", "location", "note"}]}}
+"""
+import argparse
+import datetime
+import hashlib
+import json
+from html.parser import HTMLParser
+from database import connect, create_tables, import_highlights
+from related import update_index
+from app.models import Book, Highlight
+from config import DB_PATH
+
+# Formats seen in the notebook's "last annotated" field
+ANNOTATED_DATE_FORMATS = ('%A %B %d, %Y', '%A, %B %d, %Y', '%B %d, %Y', '%d %B %Y')
+
+
+def parse_highlight_header(text):
+    """Split a header like "Yellow highlight | Page: 6" into (color, location_type, location)."""
+    color = location_type = location = None
+    if '|' in text:
+        color_part, location_part = text.split('|', 1)
+        color = color_part.strip().replace(' highlight', '').strip() or None
+        if ':' in location_part:
+            location_type, location = (part.strip() for part in location_part.split(':', 1))
+    return color, location_type, location
+
+def parse_annotated_date(value):
+    """Parse the notebook's last annotated date into an ISO datetime string, or None."""
+    value = ' '.join((value or '').split())
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        pass
+    for date_format in ANNOTATED_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+class NotebookHTMLParser(HTMLParser):
+    """Collects the library list and the open book's annotations from a saved notebook page."""
+
+    def __init__(self):
+        super().__init__()
+        self.library = []  # dicts with title, author, last_accessed, image_url
+        self.title = None
+        self.author = None
+        self.highlights = []
+        self._field = None  # field whose text is being captured
+        self._depth = 0  # nesting depth inside the captured element
+        self._text = []
+        self._in_library_book = False
+
+    def handle_starttag(self, tag, attrs):
+        if self._field:
+            self._depth += 1
+            return
+        attrs = dict(attrs)
+        classes = set((attrs.get('class') or '').split())
+        element_id = attrs.get('id') or ''
+        if tag == 'div' and 'kp-notebook-library-each-book' in classes:
+            self.library.append({'title': None, 'author': None, 'last_accessed': None, 'image_url': None})
+            self._in_library_book = True
+        elif self._in_library_book and tag == 'input' and 'kp-notebook-annotated-date' in element_id:
+            self.library[-1]['last_accessed'] = attrs.get('value')
+        elif self._in_library_book and tag == 'img' and 'kp-notebook-cover-image' in classes:
+            self.library[-1]['image_url'] = attrs.get('src')
+        elif self._in_library_book and tag == 'h2' and 'kp-notebook-searchable' in classes:
+            self._capture('library_title')
+        elif self._in_library_book and tag == 'p' and 'kp-notebook-searchable' in classes:
+            self._capture('library_author')
+        elif tag == 'h3' and 'kp-notebook-metadata' in classes and self.title is None:
+            self._capture('title')
+        elif tag == 'p' and 'kp-notebook-metadata' in classes and self.author is None and self.title is not None:
+            self._capture('author')
+        elif tag == 'span' and element_id == 'annotationHighlightHeader':
+            self._capture('header')
+        elif tag == 'span' and element_id in ('highlight', 'note') and self.highlights:
+            self._capture(element_id)
+
+    def handle_startendtag(self, tag, attrs):
+        # Void elements such as <input> and <img> never get an end tag
+        if self._field:
+            return
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if not self._field:
+            return
+        if self._depth:
+            self._depth -= 1
+            return
+        text = ' '.join(''.join(self._text).split())
+        field, self._field = self._field, None
+        if field == 'library_title':
+            self.library[-1]['title'] = text
+        elif field == 'library_author':
+            self.library[-1]['author'] = text.removeprefix('By:').strip()
+            self._in_library_book = False  # the author is the last field of a library entry
+        elif field == 'title':
+            self.title = text
+        elif field == 'author':
+            self.author = text.removeprefix('By:').strip()
+        elif field == 'header':
+            color, location_type, location = parse_highlight_header(text)
+            self.highlights.append({'text': '', 'color': color, 'location_type': location_type, 'location': location, 'note': None})
+        elif field == 'highlight':
+            self.highlights[-1]['text'] = text
+        elif field == 'note':
+            self.highlights[-1]['note'] = text or None
+
+    def handle_data(self, data):
+        if self._field:
+            self._text.append(data)
+
+    def _capture(self, field):
+        self._field = field
+        self._depth = 0
+        self._text = []
+
+def parse_notebook_html(html):
+    """Parse a saved notebook page into the scraper's JSON schema.
+
+    The page holds the whole library list but only the annotations of the
+    book that was open when it was saved; that book is the only one
+    returned with highlights.
+    """
+    parser = NotebookHTMLParser()
+    parser.feed(html)
+    parser.close()
+    if not parser.title:
+        return {}
+    library = {book['title']: book for book in parser.library if book['title']}
+    book = library.get(parser.title, {})
+    return {parser.title: {
+        'author': parser.author or book.get('author') or '',
+        'last_accessed': book.get('last_accessed'),
+        'image_url': book.get('image_url'),
+        'highlights': [h for h in parser.highlights if h['text']],
+    }}
+
+def notebook_location(location, text):
+    """Key a notebook highlight as "<location>#<hash of its text>".
+
+    Notebook locations are single numbers that several highlights can
+    share, so the text tells them apart whatever order they are listed in.
+    """
+    digest = hashlib.sha1(' '.join(text.split()).encode('utf-8')).hexdigest()[:8]
+    return f"{location}#{digest}"
+
+def iter_notebook_entries(data):
+    """Yield (Book, Highlight) pairs for import_highlights from notebook data in the scraper's schema.
+
+    Notebook highlights have no date of their own, so each gets its book's
+    last annotated date. Books located by page (rather than Kindle
+    location) use "p<page>" as the location. Locations are keyed by
+    notebook_location, which keeps re-imports idempotent and, not being
+    location ranges, keeps notebook highlights out of the collapsing of
+    overlapping clippings, which the made-up date would otherwise win.
+    """
+    for title, book_data in data.items():
+        book = Book(title=title, author=book_data.get('author') or '')
+        date_added = parse_annotated_date(book_data.get('last_accessed'))
+        for entry in book_data.get('highlights', []):
+            page = None
+            location = entry.get('location')
+            if not location or not entry.get('text'):
+                continue
+            if (entry.get('location_type') or '').lower() == 'page':
+                page = int(location) if location.isdigit() else None
+                location = f"p{location}"
+            yield book, Highlight(
+                book_id=None,
+                highlight_type='Highlight',
+                page=page,
+                location=notebook_location(location, entry['text']),
+                date_added=date_added,
+                quote=entry['text'],
+                color=entry.get('color'),
+                note=entry.get('note') or None,
+            )
+
+def load_notebook(path):
+    """Read a scraper highlights.json or a saved notebook .html page into the scraper's schema."""
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith(('.html', '.htm')):
+            return parse_notebook_html(f.read())
+        return json.load(f)
+
+def import_notebook(conn, paths):
+    """Import notebook files into the database. Returns (inserted, skipped) counts."""
+    data = {}
+    for path in paths:
+        for title, book_data in load_notebook(path).items():
+            if title in data:
+                data[title]['highlights'] += book_data['highlights']
+            else:
+                data[title] = book_data
+    return import_highlights(conn, iter_notebook_entries(data))
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Import Kindle notebook highlights (scraper JSON or saved HTML pages).")
+    arg_parser.add_argument('paths', nargs='+', help="highlights.json files and/or saved notebook .html pages")
+    return arg_parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    conn = connect(DB_PATH)
+    create_tables(conn)
+    inserted, skipped = import_notebook(conn, args.paths)
+    print(f"Imported {inserted} new highlights ({skipped} already present).")
+    update_index(conn, DB_PATH)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
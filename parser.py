@@ -1,7 +1,10 @@
 import sqlite3
 import re
 import sys
+import codecs
 import datetime
+import functools
+import os
 from dataclasses import dataclass
 from app.models import Book, Highlight
 from typing import Optional
@@ -16,29 +19,64 @@ from typing import Optional
 #     date_added: Optional[str]
 #     quote: str
 
+BOOK_AUTHOR_RE = re.compile(r'^(.*)\s*\((.*?)\)\s*$')
+# Type, page, location and date appear in this order on the second line, each optional
+HEADER_RE = re.compile(
+    r'(?:Your (\w+))?'
+    r'(?:.*?on page (\d+))?'
+    r'(?:.*?Location (\d+-\d+))?'
+    r'(?:.*?Added on (.+))?'
+)
+DATE_FORMAT = '%A, %B %d, %Y %I:%M:%S %p'
+DATE_RE = re.compile(r'\w+, (\w+) (\d{1,2}), (\d{4}) (\d{1,2}):(\d{2}):(\d{2}) ([AP]M)$')
+MONTHS = {name: number for number, name in enumerate(
+    ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+     'August', 'September', 'October', 'November', 'December'], start=1)}
+
+@functools.lru_cache(maxsize=4096)
 def parse_book_author(line):
-    """Parse book title and author from the first line."""
+    """Parse book title and author from the first line.
+
+    Cached, since every clipping of a book repeats the same line.
+    """
     book_author = line.replace('\ufeff', '').strip()
-    match = re.match(r'^(.*)\s*\((.*?)\)\s*$', book_author)
+    match = BOOK_AUTHOR_RE.match(book_author)
     book = match.group(1).strip() if match else book_author
     author = match.group(2).strip() if match else ''
     return book, author
 
+@functools.lru_cache(maxsize=4096)
+def _parse_day(month, day, year):
+    return datetime.date(int(year), MONTHS[month], int(day)).isoformat()
+
+def parse_date_added(date_str):
+    """Convert a Kindle 'Sunday, November 10, 2024 11:21:35 AM' date to ISO format.
+
+    The date part is cached (clippings from one reading session share it) and
+    the time is assembled by hand; anything unusual goes through strptime.
+    """
+    match = DATE_RE.match(date_str)
+    if match and match.group(1) in MONTHS:
+        month, day, year, hour, minute, second, meridiem = match.groups()
+        hour = int(hour)
+        if 1 <= hour <= 12 and int(minute) < 60 and int(second) < 60:
+            try:
+                date = _parse_day(month, day, year)
+            except ValueError:
+                date = None
+            if date:
+                hour = hour % 12 + (12 if meridiem == 'PM' else 0)
+                return f'{date}T{hour:02d}:{minute}:{second}'
+    return datetime.datetime.strptime(date_str, DATE_FORMAT).isoformat()
+
 def parse_highlight_info(line):
     """Parse highlight type, page, location, and date from the second line."""
     highlight_line = line.lstrip('* ').lstrip('- ').strip()
-    type_match = re.match(r'Your (\w+)', highlight_line)
-    highlight_type = type_match.group(1) if type_match else 'Unknown'
-    
-    page_match = re.search(r'on page (\d+)', highlight_line)
-    page = int(page_match.group(1)) if page_match else None
-    
-    loc_match = re.search(r'Location (\d+-\d+)', highlight_line)
-    location = loc_match.group(1) if loc_match else None
-    
-    date_match = re.search(r'Added on (.+)$', highlight_line)
-    date_added_str = date_match.group(1).strip() if date_match else None
-    date_added = datetime.datetime.strptime(date_added_str, '%A, %B %d, %Y %I:%M:%S %p').isoformat() if date_added_str else None
+    highlight_type, page, location, date_added_str = HEADER_RE.match(highlight_line).groups()
+    highlight_type = highlight_type or 'Unknown'
+    page = int(page) if page else None
+    date_added_str = date_added_str.strip() if date_added_str else None
+    date_added = parse_date_added(date_added_str) if date_added_str else None
     
     return highlight_type, page, location, date_added
 
@@ -46,64 +84,193 @@ def parse_quote(quote_lines):
     """Parse the quote from the remaining lines."""
     return ' '.join([ql.strip() for ql in quote_lines]).strip()
 
+SEPARATOR = '=========='
+CHUNK_SIZE = 64 * 1024
+
+def parse_entry(entry):
+    """Parse a single clipping (the text between two separators) into (Book, Highlight).
+
+    Returns None for blank or incomplete entries.
+    """
+    entry = entry.strip()
+    if not entry:
+        return None
+    lines = [line for line in entry.split('\n') if line.strip()]
+    if len(lines) < 3:
+        return None
+    
+    # Book and author
+    book, author = parse_book_author(lines[0])
+    
+    # Highlight info
+    highlight_type, page, location, date_added = parse_highlight_info(lines[1])
+    
+    # Quote
+    quote = parse_quote(lines[2:])
+
+    book_obj = Book(title=book, author=author)
+    highlight_obj = Highlight(
+        book_id=None,  # This will be set later when inserting into the database
+        highlight_type=highlight_type,
+        page=page,
+        location=location,
+        date_added=date_added,
+        quote=quote
+    )
+    return book_obj, highlight_obj
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE):
+    """Yield text chunks from a file object (text or binary) or an iterable of str/bytes chunks.
+
+    Bytes are decoded incrementally as UTF-8, dropping a leading BOM.
+    """
+    if hasattr(source, 'read'):
+        chunks = _read_until_empty(source, chunk_size)
+    else:
+        chunks = source
+    decoder = None
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8-sig')()
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None:
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+def _read_until_empty(fileobj, chunk_size):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_clippings(source, chunk_size=CHUNK_SIZE):
+    """Lazily parse clippings from a file object or an iterable of chunks.
+
+    Entries are yielded as soon as their closing separator is read, so memory
+    use is bounded by the longest entry rather than the size of the file.
+    """
+    buffer = ''
+    for chunk in iter_chunks(source, chunk_size):
+        # The separator may straddle two chunks, so resume the search just before the old tail
+        search_from = max(len(buffer) - len(SEPARATOR) + 1, 0)
+        buffer += chunk
+        start = 0
+        pos = buffer.find(SEPARATOR, search_from)
+        while pos != -1:
+            parsed = parse_entry(buffer[start:pos])
+            if parsed:
+                yield parsed
+            start = pos + len(SEPARATOR)
+            pos = buffer.find(SEPARATOR, start)
+        buffer = buffer[start:]
+    parsed = parse_entry(buffer)
+    if parsed:
+        yield parsed
+
+def last_entry_boundary(fileobj, size, chunk_size=CHUNK_SIZE):
+    """Return the byte offset just past the last separator in a binary file, or 0 if there is none.
+
+    The file is scanned backwards from ``size``, so only the tail is read.
+    """
+    separator = SEPARATOR.encode('ascii')
+    pos = size
+    carry = b''
+    while pos > 0:
+        start = max(pos - chunk_size, 0)
+        fileobj.seek(start)
+        # Keep the head of the previous block so a separator straddling the two is still found
+        block = fileobj.read(pos - start) + carry
+        index = block.rfind(separator)
+        if index != -1:
+            return start + index + len(separator)
+        carry = block[:len(separator) - 1]
+        pos = start
+    return 0
+
 def parse_clippings(text):
-    parsed = []
-    entries = re.split(r'==========\n?', text)
-    for entry in entries:
-        entry = entry.strip()
-        if not entry:
-            continue
-        lines = [line for line in entry.split('\n') if line.strip()]
-        if len(lines) < 3:
-            continue
-        
-        # Book and author
-        book, author = parse_book_author(lines[0])
-        
-        # Highlight info
-        highlight_type, page, location, date_added = parse_highlight_info(lines[1])
-        
-        # Quote
-        quote = parse_quote(lines[2:])
-
-        book_obj = Book(title=book, author=author)
-        highlight_obj = Highlight(
-            book_id=None,  # This will be set later when inserting into the database
-            highlight_type=highlight_type,
-            page=page,
-            location=location,
-            date_added=date_added,
-            quote=quote
-        )
-
-
-        parsed.append((book_obj, highlight_obj))
-    return parsed
+    return list(iter_clippings([text]))
+
+PARALLEL_CHUNK_SIZE = 4 * 1024 * 1024
+
+def split_ranges(fileobj, start, end, chunk_size=PARALLEL_CHUNK_SIZE):
+    """Split bytes [start, end) of a binary file into ranges that each end just past a separator.
+
+    Only the bytes around each cut point are read. The last range runs to
+    ``end`` whether or not it ends with a separator.
+    """
+    separator = SEPARATOR.encode('ascii')
+    ranges = []
+    range_start = start
+    while range_start < end:
+        pos = range_start + chunk_size
+        cut = end
+        while pos < end:
+            fileobj.seek(pos)
+            block = fileobj.read(min(CHUNK_SIZE, end - pos))
+            index = block.find(separator)
+            if index != -1 and pos + index + len(separator) <= end:
+                cut = pos + index + len(separator)
+                break
+            # Step back a little so a separator straddling two reads is not missed
+            pos += max(len(block) - len(separator) + 1, 1)
+        ranges.append((range_start, cut))
+        range_start = cut
+    return ranges
+
+def _parse_range(path, start, end):
+    """Worker: parse one byte range, returning plain tuples (much cheaper to pickle than dataclasses)."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return [
+        (book.title, book.author, highlight.highlight_type, highlight.page, highlight.location, highlight.date_added, highlight.quote)
+        for book, highlight in iter_clippings([codecs.decode(data, 'utf-8-sig')])
+    ]
+
+def iter_clippings_parallel(path, workers=None, start=0, chunk_size=PARALLEL_CHUNK_SIZE):
+    """Parse a clippings file on disk in a pool of worker processes, yielding entries in file order.
 
+    The file (from byte ``start``) is cut at separators into ranges of about
+    ``chunk_size`` bytes which workers parse independently. Only a couple of
+    ranges per worker are in flight at once, so parsed results do not pile up
+    ahead of the consumer.
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        ranges = split_ranges(f, start, end, chunk_size)
+    from concurrent.futures import ProcessPoolExecutor  # slow to import, and only needed here
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        ranges = iter(ranges)
+        for range_start, range_end in ranges:
+            pending.append(executor.submit(_parse_range, path, range_start, range_end))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            entries = pending.pop(0).result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(executor.submit(_parse_range, path, *next_range))
+            for title, author, highlight_type, page, location, date_added, quote in entries:
+                yield Book(title=title, author=author), Highlight(
+                    book_id=None,
+                    highlight_type=highlight_type,
+                    page=page,
+                    location=location,
+                    date_added=date_added,
+                    quote=quote
+                )
 
 
 if __name__ == '__main__':
+    # Parse My Clippings.txt straight to CSV, without touching the database
+    from export import iter_csv
 
-    clippings_file = 'My Clippings.txt'
-    with open(clippings_file, 'r', encoding='utf-8-sig') as f:
-        text = f.read()
-
-    highlights = parse_clippings(text)
-
-    # output the parsed highlights to csv
-    import csv
-    with open('parsed_clippings.csv', 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['book', 'author', 'highlight_type', 'page', 'location', 'date_added', 'quote']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for h in highlights:
-            writer.writerow({
-                'book': h.book,
-                'author': h.author,
-                'highlight_type': h.highlight_type,
-                'page': h.page,
-                'location': h.location,
-                'date_added': h.date_added,
-                'quote': h.quote
-            })
+    with open('My Clippings.txt', 'rb') as f, open('parsed_clippings.csv', 'w', newline='', encoding='utf-8') as csvfile:
+        csvfile.writelines(iter_csv((highlight, book) for book, highlight in iter_clippings(f)))
@@ -0,0 +1,255 @@
+"""Related highlights: a TF-IDF index over every quote, answering top-k cosine similarity queries.
+
+Quotes are split into words and word pairs, which are hashed into a fixed
+number of feature columns, so new quotes never change the vocabulary. The
+term frequencies are kept as a sparse row-per-highlight matrix in NumPy
+arrays and saved next to the database. IDF weights and an inverted index
+are derived in memory, so a query only touches the highlights sharing a
+term with the one asked about.
+
+The index follows the database incrementally: highlights above the highest
+id it has seen are appended, and those logged in highlight_changes (quote
+edited or highlight deleted) are read again or dropped.
+"""
+import os
+import re
+import threading
+import zipfile
+import zlib
+import numpy as np
+from database import get_generation, iter_highlight_quotes, get_highlight_quotes, get_highlight_changes, prune_highlight_changes
+
+# Feature columns words and word pairs are hashed into
+FEATURES = 2 ** 18
+# Bumped whenever tokenizing or hashing changes, so saved indexes are rebuilt
+INDEX_VERSION = 1
+# Terms found in more than this share of quotes are too common to say two quotes are related
+MAX_DOCUMENT_FREQUENCY = 0.5
+# Highlights read from the database per step while building the index
+BUILD_BATCH_SIZE = 5000
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+themselves then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+def index_path(db_path):
+    """Where the index for the database at db_path is saved."""
+    return os.path.splitext(db_path)[0] + '.related.npz'
+
+def terms(text):
+    """Return the words of text, without stop words, followed by each pair of consecutive words."""
+    words = [word for word in TOKEN_RE.findall(text.lower()) if len(word) > 1 and word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+def vectorize(texts):
+    """Return (lengths, columns, term frequencies) of the sparse rows for texts, columns ascending within a row."""
+    rows, columns = [], []
+    for row, text in enumerate(texts):
+        text_columns = [zlib.crc32(term.encode('utf-8')) % FEATURES for term in terms(text)]
+        rows.extend([row] * len(text_columns))
+        columns.extend(text_columns)
+    # One sort over (row, column) keys counts every row's terms at once
+    keys, counts = np.unique(np.array(rows, dtype=np.int64) * FEATURES + np.array(columns, dtype=np.int64), return_counts=True)
+    lengths = np.bincount(keys // FEATURES, minlength=len(texts))
+    return lengths, (keys % FEATURES).astype(np.int32), (1 + np.log(counts)).astype(np.float32)
+
+
+class RelatedIndex:
+    """Sparse term-frequency rows for highlights, with what is needed to query them.
+
+    ``ids[i]``'s row holds ``indices``/``tf`` entries ``indptr[i]:indptr[i + 1]``.
+    ``max_id`` is the highest highlight id read, ``seq`` the last entry of
+    highlight_changes applied and ``generation`` the library generation the
+    index was last brought up to date at (-1 before the first sync).
+    """
+
+    def __init__(self, ids=None, indptr=None, indices=None, tf=None, max_id=0, seq=0, generation=-1):
+        self.ids = np.zeros(0, dtype=np.int64) if ids is None else ids
+        self.indptr = np.zeros(1, dtype=np.int64) if indptr is None else indptr
+        self.indices = np.zeros(0, dtype=np.int32) if indices is None else indices
+        self.tf = np.zeros(0, dtype=np.float32) if tf is None else tf
+        self.max_id = max_id
+        self.seq = seq
+        self.generation = generation
+        self.mtime = None  # of the file last loaded or saved
+        self._prepared = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, rows):
+        """Append (id, quote) rows."""
+        if not rows:
+            return
+        ids = np.array([highlight_id for highlight_id, _ in rows], dtype=np.int64)
+        lengths, columns, frequencies = vectorize([quote or '' for _, quote in rows])
+        self.ids = np.concatenate([self.ids, ids])
+        self.indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(lengths)])
+        self.indices = np.concatenate([self.indices, columns])
+        self.tf = np.concatenate([self.tf, frequencies])
+        self.max_id = max(self.max_id, int(ids.max()))
+        self._prepared = None
+
+    def remove(self, highlight_ids):
+        """Drop the rows of the given highlight ids."""
+        keep = ~np.isin(self.ids, np.fromiter(highlight_ids, dtype=np.int64))
+        if keep.all():
+            return
+        lengths = np.diff(self.indptr)
+        self.ids = self.ids[keep]
+        self.indices = self.indices[np.repeat(keep, lengths)]
+        self.tf = self.tf[np.repeat(keep, lengths)]
+        self.indptr = np.concatenate([[0], np.cumsum(lengths[keep])]).astype(np.int64)
+        self._prepared = None
+
+    def sync(self, conn):
+        """Bring the index up to date with the database. Returns True if any highlight was indexed or dropped.
+
+        Tag edits also bump the generation; they cost two small queries here.
+        """
+        generation = get_generation(conn)[0]
+        if generation == self.generation:
+            return False
+        if generation < self.generation:
+            # The database was replaced by an older or different one
+            self.__init__()
+        modified = False
+        last_seq, changed = get_highlight_changes(conn, self.seq)
+        # Changed highlights above max_id are read below with the new ones
+        changed = {highlight_id for highlight_id in changed if highlight_id <= self.max_id}
+        if changed:
+            self.remove(changed)
+            self.add(get_highlight_quotes(conn, changed))
+            modified = True
+        cursor = iter_highlight_quotes(conn, self.max_id)
+        while rows := cursor.fetchmany(BUILD_BATCH_SIZE):
+            self.add(rows)
+            modified = True
+        modified = modified or last_seq != self.seq
+        self.seq = last_seq
+        self.generation = generation
+        return modified
+
+    def _prepare(self):
+        """Weigh the rows by IDF, normalise them and build the inverted index, once per change."""
+        if self._prepared is not None:
+            return self._prepared
+        count = len(self.ids)
+        row_of = np.repeat(np.arange(count), np.diff(self.indptr))
+        df = np.bincount(self.indices, minlength=FEATURES)
+        idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+        weights = self.tf * idf[self.indices]
+        norms = np.sqrt(np.bincount(row_of, weights.astype(np.float64) ** 2, minlength=count)).astype(np.float32)
+        weights /= norms[row_of]
+        by_column = np.argsort(self.indices, kind='stable')
+        colptr = np.zeros(FEATURES + 1, dtype=np.int64)
+        np.cumsum(df, out=colptr[1:])
+        id_order = np.argsort(self.ids)
+        self._prepared = {
+            'df': df,
+            'weights': weights,
+            'colptr': colptr,
+            'posting_rows': row_of[by_column],
+            'posting_weights': weights[by_column],
+            'id_order': id_order,
+            'sorted_ids': self.ids[id_order],
+        }
+        return self._prepared
+
+    def similar(self, highlight_id, k=10):
+        """Return up to k (id, score) pairs of the highlights most similar to highlight_id, best first.
+
+        Raises KeyError if the highlight is not in the index.
+        """
+        prepared = self._prepare()
+        position = np.searchsorted(prepared['sorted_ids'], highlight_id)
+        if position == len(self.ids) or prepared['sorted_ids'][position] != highlight_id:
+            raise KeyError(highlight_id)
+        row = prepared['id_order'][position]
+        start, end = self.indptr[row], self.indptr[row + 1]
+        columns = self.indices[start:end]
+        query_weights = prepared['weights'][start:end]
+        distinctive = prepared['df'][columns] <= max(MAX_DOCUMENT_FREQUENCY * len(self.ids), 2)
+        columns, query_weights = columns[distinctive], query_weights[distinctive]
+
+        # Gather the postings of every query column in one go
+        starts = prepared['colptr'][columns]
+        lengths = prepared['colptr'][columns + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        rows = prepared['posting_rows'][offsets]
+        contributions = prepared['posting_weights'][offsets] * np.repeat(query_weights, lengths)
+        scores = np.bincount(rows, contributions, minlength=len(self.ids))
+        scores[row] = 0
+
+        k = min(k, len(self.ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(self.ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, path):
+        """Write the index to path, replacing the old file only once the new one is complete."""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, ids=self.ids, indptr=self.indptr, indices=self.indices, tf=self.tf,
+                     meta=np.array([INDEX_VERSION, FEATURES, self.max_id, self.seq, self.generation], dtype=np.int64))
+        os.replace(temp_path, path)
+        self.mtime = os.stat(path).st_mtime_ns
+
+    @classmethod
+    def load(cls, path):
+        """Read an index saved by save(), or return an empty one if there is none or it is unusable."""
+        try:
+            with np.load(path) as data:
+                version, features, max_id, seq, generation = (int(value) for value in data['meta'])
+                if (version, features) != (INDEX_VERSION, FEATURES):
+                    return cls()
+                index = cls(data['ids'], data['indptr'], data['indices'], data['tf'], max_id, seq, generation)
+            index.mtime = os.stat(path).st_mtime_ns
+            return index
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return cls()
+
+
+_lock = threading.Lock()
+_indexes = {}  # index path -> RelatedIndex
+
+def _current_index(conn, db_path, prune=False):
+    """Return the up-to-date index for db_path, saving it if it had to be updated. Call with _lock held.
+
+    With prune, the applied entries of highlight_changes are deleted, which
+    needs a write; queries leave that to the next import.
+    """
+    path = index_path(db_path)
+    index = _indexes.get(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if index is None or (mtime is not None and mtime != index.mtime):
+        # First use, or another process (such as a command line import) saved a newer one
+        index = _indexes[path] = RelatedIndex.load(path)
+    if index.sync(conn) or mtime is None:
+        index.save(path)
+    if prune and index.seq:
+        prune_highlight_changes(conn, index.seq)
+    return index
+
+def update_index(conn, db_path):
+    """Bring the saved index for db_path up to date, e.g. after an import. Returns the number of highlights indexed."""
+    with _lock:
+        return len(_current_index(conn, db_path, prune=True))
+
+def find_related(conn, db_path, highlight_id, k=10):
+    """Return up to k (id, score) pairs for the highlights most similar to highlight_id, best first.
+
+    Raises KeyError if there is no such highlight.
+    """
+    with _lock:
+        return _current_index(conn, db_path).similar(highlight_id, k)
@@ -1,14 +1,105 @@
 from app import app
 from app import routes
+import argparse
+import signal
 import threading
 import webbrowser
 import time
 
-def open_browser():
+# How often the production server's event loop checks for a shutdown request
+LOOP_TIMEOUT = 1.0
+
+def open_browser(port=5001):
     time.sleep(2)  # Wait for server to start
-    webbrowser.open('http://localhost:5001')
+    webbrowser.open(f'http://localhost:{port}')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the BookMarker web app.")
+    parser.add_argument('--production', action='store_true',
+                        help="serve with a pool of worker threads (waitress) instead of the single-user desktop server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--no-browser', action='store_true', help="don't open a browser window (desktop mode)")
+    parser.add_argument('--threads', type=int, default=8, help="worker threads handling requests (production)")
+    parser.add_argument('--connection-limit', type=int, default=100,
+                        help="open connections served at once; further ones wait in the listen backlog (production)")
+    parser.add_argument('--backlog', type=int, default=1024, help="listen backlog size (production)")
+    parser.add_argument('--keepalive', type=int, default=120,
+                        help="seconds an idle keep-alive connection is kept open (production)")
+    parser.add_argument('--drain-timeout', type=float, default=30,
+                        help="seconds allowed for in-flight requests to finish on SIGTERM (production)")
+    return parser.parse_args(argv)
+
+def create_production_server(wsgi_app, host, port, threads=8, connection_limit=100, backlog=1024, keepalive=120):
+    from waitress.server import create_server
+    return create_server(wsgi_app, host=host, port=port, threads=threads, connection_limit=connection_limit,
+                         backlog=backlog, channel_timeout=keepalive)
+
+def listeners(server):
+    """Return the listening servers behind a waitress server.
+
+    When the host resolves to several addresses (such as localhost on a
+    dual-stack machine) create_server returns a MultiSocketServer, which
+    only holds the socket map its per-address servers registered in.
+    """
+    from waitress.server import BaseWSGIServer, MultiSocketServer
+    if isinstance(server, MultiSocketServer):
+        return [channel for channel in server.map.values() if isinstance(channel, BaseWSGIServer)]
+    return [server]
+
+def serve(server, stop, drain_timeout=30):
+    """Run a waitress server until the stop event is set, then drain it.
+
+    Draining stops accepting connections, lets requests already received
+    finish and flush their responses, closes idle keep-alive connections and
+    finally stops the worker threads. Whatever is still running after
+    ``drain_timeout`` seconds is abandoned.
+    """
+    servers = listeners(server)
+    # Every listener shares one socket map and task dispatcher
+    socket_map = servers[0]._map
+    while not stop.is_set():
+        server.asyncore.loop(timeout=LOOP_TIMEOUT, map=socket_map, count=1)
+
+    # Close the listening sockets so new connections are refused straight away
+    for listener in servers:
+        listener.accepting = False
+        listener.del_channel()
+        listener.socket.close()
+    deadline = time.monotonic() + drain_timeout
+    while any(listener.active_channels for listener in servers) and time.monotonic() < deadline:
+        for listener in servers:
+            for channel in list(listener.active_channels.values()):
+                if not channel.requests and channel.request is None and not channel.total_outbufs_len:
+                    channel.will_close = True
+        server.asyncore.loop(timeout=0.1, map=socket_map, count=1)
+    server.task_dispatcher.shutdown(timeout=max(deadline - time.monotonic(), 0))
+    server.asyncore.close_all(socket_map)
+
+def serve_production(args):
+    server = create_production_server(app, args.host, args.port, args.threads, args.connection_limit,
+                                      args.backlog, args.keepalive)
+    servers = listeners(server)
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            stop.set()
+            servers[0].pull_trigger()  # wake the event loop
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    for listener in servers:
+        host = f"[{listener.effective_host}]" if ':' in listener.effective_host else listener.effective_host
+        print(f"Serving on http://{host}:{listener.effective_port}")
+    serve(server, stop, args.drain_timeout)
 
 if __name__ == '__main__':
-    # Start browser in a separate thread
-    threading.Thread(target=open_browser).start()
-    app.run(host='127.0.0.1', port=5001, debug=False)
\ No newline at end of file
+    args = parse_args()
+    if args.production:
+        serve_production(args)
+    else:
+        if not args.no_browser:
+            # Start browser in a separate thread
+            threading.Thread(target=open_browser, args=(args.port,)).start()
+        app.run(host=args.host, port=args.port, debug=False)
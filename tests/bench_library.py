@@ -0,0 +1,127 @@
+"""Benchmark suite over synthetic libraries of increasing size.
+
+Times parsing, importing, the main database queries and full page renders
+through the Flask test client, then prints the results as JSON so runs from
+different commits can be diffed or plotted.
+
+    python tests/bench_library.py --sizes 10000 100000 1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app.db
+from app import app as flask_app, routes
+from database import (
+    connect, create_tables, close_connections, get_books_with_stats, search_highlights,
+    get_highlights_for_tag, get_all_tags, fuzzy_search_highlights
+)
+from main import import_clippings
+from parser import parse_clippings
+from synthetic import write_clippings, add_tags
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+SEARCH_QUERIES = ('the', 'ocean', 'silence courage', '"power of"', 'strat')
+# Misspelled queries the exact search finds nothing for
+FUZZY_QUERIES = ('herbret', 'ocaen silense', 'memroy of watter', 'strategie questoin')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def repeat(func, repeats):
+    """Run func repeats times and return timing statistics in seconds."""
+    timings = [timed(func)[0] for _ in range(repeats)]
+    return {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings), 'repeats': repeats}
+
+def bench_size(size, workdir, repeats):
+    results = []
+
+    def record(name, **values):
+        results.append(dict(size=size, name=name, **values))
+        print(f"{size:>9} {name:<32} {values.get('median', values.get('seconds')):.4f}s", file=sys.stderr)
+
+    clippings_path = write_clippings(os.path.join(workdir, f'clippings-{size}.txt'), size)
+    with open(clippings_path, 'r', encoding='utf-8-sig') as f:
+        text = f.read()
+    seconds, parsed = timed(parse_clippings, text)
+    record('parse_clippings', seconds=seconds, entries=len(parsed), entries_per_second=len(parsed) / seconds)
+    del text, parsed
+
+    db_path = os.path.join(workdir, f'library-{size}.db')
+    conn = connect(db_path)
+    create_tables(conn)
+    seconds, (inserted, skipped, _) = timed(import_clippings, conn, clippings_path)
+    record('import_clippings', seconds=seconds, inserted=inserted, skipped=skipped, entries_per_second=(inserted + skipped) / seconds)
+    add_tags(conn)
+
+    biggest_tag = max(get_all_tags(conn), key=lambda tag: conn.execute(
+        "SELECT COUNT(*) FROM highlight_tags WHERE tag_id = ?", (tag.id,)).fetchone()[0])
+    record('get_books_with_stats', **repeat(lambda: get_books_with_stats(conn), repeats))
+    for query in SEARCH_QUERIES:
+        record(f'search_highlights[{query}]', **repeat(lambda: search_highlights(conn, query), repeats))
+    for query in FUZZY_QUERIES:
+        record(f'fuzzy_search_highlights[{query}]', **repeat(lambda: fuzzy_search_highlights(conn, query), repeats))
+    record('get_highlights_for_tag', **repeat(lambda: get_highlights_for_tag(conn, biggest_tag.id), repeats))
+    first_book = get_books_with_stats(conn)[0]
+    conn.close()
+
+    app.db.DB_PATH = db_path
+    client = flask_app.test_client()
+    for name, url in (
+        ('render /', '/'),
+        ('render /?book_id', f'/?book_id={first_book.id}'),
+        ('render /?q', '/?q=ocean'),
+        ('render /?q (fuzzy)', '/?q=ocaen+silense'),
+        ('render /tags', '/tags'),
+        ('render /tags?tag_id', f'/tags?tag_id={biggest_tag.id}'),
+    ):
+        record(name, **repeat(lambda: client.get(url).data, repeats))
+    close_connections(db_path)
+    return results
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="numbers of highlights to benchmark")
+    arg_parser.add_argument('--repeat', type=int, default=5, help="runs per query/render timing")
+    arg_parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = arg_parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            report['results'] += bench_size(size, workdir, args.repeat)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Micro-benchmark for the clippings parser hot path.
+
+Generates a synthetic clippings file and reports entries/second for the
+original per-field regex parser ("before") and the current parser ("after").
+
+    python tests/bench_parser.py --entries 500000
+"""
+import argparse
+import datetime
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser as clippings_parser
+from synthetic import write_clippings
+
+
+def legacy_parse_book_author(line):
+    book_author = line.replace('\ufeff', '').strip()
+    match = re.match(r'^(.*)\s*\((.*?)\)\s*$', book_author)
+    book = match.group(1).strip() if match else book_author
+    author = match.group(2).strip() if match else ''
+    return book, author
+
+def legacy_parse_highlight_info(line):
+    highlight_line = line.lstrip('* ').lstrip('- ').strip()
+    type_match = re.match(r'Your (\w+)', highlight_line)
+    highlight_type = type_match.group(1) if type_match else 'Unknown'
+    page_match = re.search(r'on page (\d+)', highlight_line)
+    page = int(page_match.group(1)) if page_match else None
+    loc_match = re.search(r'Location (\d+-\d+)', highlight_line)
+    location = loc_match.group(1) if loc_match else None
+    date_match = re.search(r'Added on (.+)$', highlight_line)
+    date_added_str = date_match.group(1).strip() if date_match else None
+    date_added = datetime.datetime.strptime(date_added_str, '%A, %B %d, %Y %I:%M:%S %p').isoformat() if date_added_str else None
+    return highlight_type, page, location, date_added
+
+def run(path):
+    start = time.perf_counter()
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        count = sum(1 for _ in clippings_parser.iter_clippings(f))
+    return count, time.perf_counter() - start
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--entries', type=int, default=500_000)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'My Clippings.txt')
+        write_clippings(path, args.entries)
+
+        current = (clippings_parser.parse_book_author, clippings_parser.parse_highlight_info)
+        clippings_parser.parse_book_author = legacy_parse_book_author
+        clippings_parser.parse_highlight_info = legacy_parse_highlight_info
+        try:
+            count, before = run(path)
+        finally:
+            clippings_parser.parse_book_author, clippings_parser.parse_highlight_info = current
+        _, after = run(path)
+
+    print(f"{count} entries")
+    print(f"before: {count / before:,.0f} entries/s ({before:.2f}s)")
+    print(f"after:  {count / after:,.0f} entries/s ({after:.2f}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Cold start benchmark: time from process start to the first served request.
+
+Launches the app in a scratch directory, polls it until a page is served
+and prints the timings as JSON. The first run starts without a database,
+so it includes creating the schema; the following runs reuse it. Pass
+--command to time a packaged build instead of run.py, e.g.
+
+    python tests/bench_startup.py --runs 5
+    python tests/bench_startup.py --command "dist/run/run --no-browser --port {port}"
+"""
+import argparse
+import json
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_COMMAND = f"{shlex.quote(sys.executable)} {shlex.quote(os.path.join(ROOT, 'run.py'))} --no-browser --port {{port}}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def time_to_first_request(command, workdir, path, timeout):
+    """Start command in workdir and return the seconds until GET path succeeds."""
+    port = free_port()
+    url = f'http://127.0.0.1:{port}{path}'
+    start = time.perf_counter()
+    process = subprocess.Popen(shlex.split(command.format(port=port)), cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"{command!r} exited with status {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"no response from {url} within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--command', default=DEFAULT_COMMAND, help="command to start; {port} is replaced by a free port")
+    arg_parser.add_argument('--path', default='/', help="page requested once the server is up")
+    arg_parser.add_argument('--runs', type=int, default=5)
+    arg_parser.add_argument('--timeout', type=float, default=60)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        timings = [time_to_first_request(args.command, workdir, args.path, args.timeout) for _ in range(args.runs)]
+    warm = timings[1:] or timings
+    print(json.dumps({
+        'command': args.command,
+        'first_run': timings[0],
+        'median': statistics.median(warm),
+        'min': min(warm),
+        'max': max(warm),
+        'runs': timings,
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Deterministic synthetic Kindle libraries for benchmarks.
+
+The same arguments always produce byte-identical clippings files and the
+same tag assignments, so timings can be compared across commits.
+"""
+import datetime
+import random
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but have an they "
+    "you were her she there been one all we their has would when if so no what up out more can about into than them "
+    "time people could other these two may first then do any like my now over such our man me even most made after "
+    "also did many before must through back years where much your way well down should because each just those mind "
+    "war power history light water world truth memory silence courage fear love death reason nature freedom empire "
+    "river mountain ocean letter garden winter machine language science money habit strategy question answer story"
+).split()
+FIRST_NAMES = ["Andrew", "Mary", "Chris", "Ada", "Leo", "Grace", "Ken", "Ursula", "Frank", "Toni", "Isaac", "Zadie"]
+LAST_NAMES = ["Roberts", "Voss", "Shelley", "Lovelace", "Tolstoy", "Hopper", "Liu", "Le Guin", "Herbert", "Morrison", "Asimov", "Smith"]
+
+
+def _kindle_date(moment):
+    return f"{moment.strftime('%A, %B')} {moment.day}, {moment.year} {moment.strftime('%I:%M:%S %p')}"
+
+def make_books(count, rng):
+    books = []
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, 4))) + f" {i}"
+        author = f"{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}"
+        books.append((title, author))
+    return books
+
+def iter_clipping_texts(highlights, books=None, notes=0.05, date_spread_days=1500, seed=0):
+    """Yield the text of each clipping (separator included) of a synthetic library.
+
+    ``books`` defaults to roughly one book per 150 highlights. ``notes`` is the
+    fraction of entries written as notes, which Kindle gives a single location.
+    Dates rise steadily across ``date_spread_days``, as in a real file.
+    """
+    rng = random.Random(seed)
+    book_list = make_books(books or max(1, highlights // 150), rng)
+    next_location = [rng.randint(10, 500) for _ in book_list]
+    start = datetime.datetime(2020, 1, 1)
+    step = date_spread_days * 86400 / max(highlights, 1)
+    for i in range(highlights):
+        book_index = rng.randrange(len(book_list))
+        title, author = book_list[book_index]
+        location = next_location[book_index]
+        length = rng.randint(8, 60)
+        next_location[book_index] += length // 10 + rng.randint(2, 40)
+        moment = start + datetime.timedelta(seconds=int(i * step))
+        page = location // 15
+        quote = " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+        if rng.random() < notes:
+            header = f"- Your Note on page {page} | Location {location} | Added on {_kindle_date(moment)}"
+        else:
+            header = f"- Your Highlight on page {page} | Location {location}-{location + length // 10 + 1} | Added on {_kindle_date(moment)}"
+        yield f"{title} ({author})\n{header}\n\n{quote}\n==========\n"
+
+def write_clippings(path, highlights, **options):
+    """Write a synthetic My Clippings.txt (with the BOM Kindle adds) and return its path."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\ufeff')
+        for text in iter_clipping_texts(highlights, **options):
+            f.write(text)
+    return path
+
+def add_tags(conn, tags=30, tagged=0.2, max_tags_per_highlight=3, seed=0):
+    """Create ``tags`` tags and attach up to a few of them to a ``tagged`` fraction of highlights.
+
+    Tag popularity is skewed, so some tags are much larger than others.
+    """
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(f"tag-{i:03d}",) for i in range(tags)])
+    cursor.execute("SELECT id FROM tags ORDER BY name")
+    tag_ids = [row[0] for row in cursor.fetchall()]
+    weights = [1 / (rank + 1) for rank in range(len(tag_ids))]
+    cursor.execute("SELECT id FROM highlights ORDER BY id")
+    pairs = set()
+    for (highlight_id,) in cursor.fetchall():
+        if rng.random() < tagged:
+            for tag_id in rng.choices(tag_ids, weights, k=rng.randint(1, max_tags_per_highlight)):
+                pairs.add((highlight_id, tag_id))
+    cursor.executemany("INSERT OR IGNORE INTO highlight_tags (highlight_id, tag_id) VALUES (?, ?)", sorted(pairs))
+    conn.commit()
+    return tag_ids
@@ -4,8 +4,16 @@ from database import (
     create_tables, get_last_import_date, set_last_import_date,
     get_books_with_stats, get_highlights_for_book, get_book_by_id, search_highlights,
     insert_book, insert_highlight, get_all_tags, get_tag_by_id, insert_tag, update_tag, delete_tag,
-    get_tags_for_highlight, add_tag_to_highlight, remove_tag_from_highlight, get_highlights_for_book_with_tags, get_highlights_for_tag
+    get_tags_for_highlight, add_tag_to_highlight, remove_tag_from_highlight, get_highlights_for_book_with_tags, get_highlights_for_tag,
+    build_fts_query, get_tags_for_highlights, attach_tags, import_highlights,
+    get_highlights_for_book_page, search_highlights_page, decode_cursor, encode_cursor,
+    connect, acquire_connection, release_connection, close_connections, location_range,
+    get_tags_with_counts, get_generation, set_tags_for_highlight,
+    migrate, SCHEMA_VERSION, iter_highlights_for_book, iter_books_with_stats, iter_highlights_for_tag,
+    get_highlights_by_ids, iter_highlight_quotes, get_highlight_quotes, get_highlight_changes,
+    search_words, trigram_similarity, edit_distance, suggest_terms, fuzzy_search_highlights
 )
+from app.models import Book, Highlight
 
 @pytest.fixture
 def conn():
@@ -134,6 +142,64 @@ def test_search_highlights(conn):
     results = search_highlights(conn, "nonexistent")
     assert results == []
 
+def test_search_highlights_prefix_and_phrase(conn):
+    book_id = insert_book(conn, "Dune", "Herbert, Frank")
+    insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Fear is the mind-killer.")
+    insert_highlight(conn, book_id, "Highlight", 2, "3-4", "2024-01-02T00:00:00", "The mind is a killer of fear.")
+    conn.commit()
+
+    # Prefix match
+    assert len(search_highlights(conn, "kill")) == 2
+    assert len(search_highlights(conn, "herb")) == 2
+
+    # Phrase match only hits the adjacent words
+    results = search_highlights(conn, '"mind killer"')
+    assert len(results) == 1
+    assert results[0][0].quote == "Fear is the mind-killer."
+
+    # Punctuation only
+    assert search_highlights(conn, '" - "') == []
+
+def test_search_highlights_ranked_by_relevance(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-02T00:00:00", "One mention of ocean among many other unrelated words here.")
+    insert_highlight(conn, book_id, "Highlight", 2, "3-4", "2024-01-01T00:00:00", "Ocean, ocean, ocean.")
+    conn.commit()
+
+    results = search_highlights(conn, "ocean")
+    assert [h.quote for h, _ in results] == ["Ocean, ocean, ocean.", "One mention of ocean among many other unrelated words here."]
+
+def test_search_index_follows_updates_and_deletes(conn):
+    book_id = insert_book(conn, "Old Title", "Author")
+    highlight_id = insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Quote")
+    conn.commit()
+
+    conn.execute("UPDATE books SET title = 'New Title' WHERE id = ?", (book_id,))
+    assert search_highlights(conn, "old") == []
+    assert len(search_highlights(conn, "new")) == 1
+
+    conn.execute("DELETE FROM highlights WHERE id = ?", (highlight_id,))
+    assert search_highlights(conn, "new") == []
+
+def test_search_index_backfills_existing_database(conn):
+    book_id = insert_book(conn, "Backfill Book", "Author")
+    insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Already here")
+    conn.execute("DROP TABLE highlights_fts")
+    conn.execute("PRAGMA user_version = 0")  # as before schema versioning
+    conn.commit()
+
+    create_tables(conn)
+    assert len(search_highlights(conn, "already")) == 1
+    # Running again does not duplicate rows
+    create_tables(conn)
+    assert len(search_highlights(conn, "already")) == 1
+
+def test_build_fts_query():
+    assert build_fts_query("fear mind") == '"fear"* AND "mind"*'
+    assert build_fts_query('"mind killer" fear') == '"mind killer" AND "fear"*'
+    assert build_fts_query('say "hi') == '"say"* AND "hi"'
+    assert build_fts_query("  ") is None
+
 def test_insert_book_new(conn):
     book_id = insert_book(conn, "New Book", "New Author")
     assert book_id is not None
@@ -334,4 +400,609 @@ def test_get_highlights_for_tag(conn):
     assert len(highlight2.tags) == 2
     tag_names = [t.name for t in highlight2.tags]
     assert "Tag3" in tag_names
-    assert "Tag4" in tag_names
\ No newline at end of file
+    assert "Tag4" in tag_names
+
+def count_queries(conn, func, *args):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        func(conn, *args)
+    finally:
+        conn.set_trace_callback(None)
+    return len(statements)
+
+def test_tag_loading_query_count_is_constant(conn):
+    tag_id = insert_tag(conn, "Bulk")
+    counts = []
+    for size in (1, 50):
+        book_id = insert_book(conn, f"Book {size}", "Author")
+        for i in range(size):
+            highlight_id = insert_highlight(conn, book_id, "Highlight", i, f"{i}-{i + 1}", "2024-01-01", f"Quote {i}")
+            add_tag_to_highlight(conn, highlight_id, tag_id)
+        highlights = get_highlights_for_book_with_tags(conn, book_id)
+        assert len(highlights) == size
+        assert all(h.tags[0].name == "Bulk" for h in highlights)
+        counts.append((
+            count_queries(conn, get_highlights_for_book_with_tags, book_id),
+            count_queries(conn, get_highlights_for_tag, tag_id),
+        ))
+    assert counts[0] == counts[1]
+
+def test_get_tags_for_highlights(conn):
+    book_id = insert_book(conn, "Book7", "Author7")
+    highlight_id1 = insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01", "Quote1")
+    highlight_id2 = insert_highlight(conn, book_id, "Highlight", 2, "3-4", "2024-01-02", "Quote2")
+    tag_b = insert_tag(conn, "B")
+    tag_a = insert_tag(conn, "A")
+    add_tag_to_highlight(conn, highlight_id1, tag_b)
+    add_tag_to_highlight(conn, highlight_id1, tag_a)
+
+    tags = get_tags_for_highlights(conn, [highlight_id1, highlight_id2])
+    assert [t.name for t in tags[highlight_id1]] == ["A", "B"]
+    assert tags[highlight_id2] == []
+    assert get_tags_for_highlights(conn, []) == {}
+
+    highlights = attach_tags(conn, get_highlights_for_book(conn, book_id))
+    assert {h.id: len(h.tags) for h in highlights} == {highlight_id1: 2, highlight_id2: 0}
+
+def make_entry(title, author, location, date_added, quote):
+    return Book(title=title, author=author), Highlight(
+        book_id=None, highlight_type="Highlight", page=None,
+        location=location, date_added=date_added, quote=quote
+    )
+
+def test_import_highlights(conn):
+    existing_id = insert_book(conn, "Existing", "Author")
+    insert_highlight(conn, existing_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Old")
+    conn.commit()
+
+    entries = [
+        make_entry("Existing", "Author", "1-2", "2024-01-01T00:00:00", "Old"),  # duplicate
+        make_entry("Existing", "Author", "3-4", "2024-01-02T00:00:00", "New in existing book"),
+        make_entry("Fresh", "Writer", "5-6", "2024-01-03T00:00:00", "First of fresh"),
+        make_entry("Fresh", "Writer", "7-8", None, "Undated"),
+        make_entry("Fresh", "Writer", "7-8", None, "Undated"),  # duplicate within the import
+    ]
+    inserted, skipped = import_highlights(conn, iter(entries), batch_size=2)
+    assert (inserted, skipped) == (3, 2)
+
+    books = {b.title: b for b in get_books_with_stats(conn)}
+    assert books["Existing"].id == existing_id
+    assert books["Existing"].highlight_count == 2
+    assert books["Fresh"].highlight_count == 2
+    assert len(search_highlights(conn, "fresh")) == 2
+
+def test_import_highlights_since(conn):
+    entries = [
+        make_entry("Book", "Author", "1-2", "2024-01-01T00:00:00", "Before"),
+        make_entry("Book", "Author", "3-4", "2024-02-01T00:00:00", "After"),
+        make_entry("Book", "Author", "5-6", None, "Undated"),
+    ]
+    inserted, skipped = import_highlights(conn, entries, since="2024-01-15T00:00:00")
+    assert (inserted, skipped) == (2, 1)
+    assert get_books_with_stats(conn)[0].highlight_count == 2
+
+def test_import_highlights_rolls_back_on_error(conn):
+    def entries():
+        yield make_entry("Book", "Author", "1-2", "2024-01-01T00:00:00", "Fine")
+        raise ValueError("bad clipping")
+    with pytest.raises(ValueError):
+        import_highlights(conn, entries(), batch_size=1)
+    assert get_books_with_stats(conn) == []
+
+def test_get_highlights_for_book_page(conn):
+    book_id = insert_book(conn, "Paged", "Author")
+    # Repeated and missing dates exercise the id tie-break and the NULL branch
+    dates = ["2024-01-03", "2024-01-02", "2024-01-02", None, "2024-01-01", None, "2024-01-02"]
+    for i, date_added in enumerate(dates):
+        insert_highlight(conn, book_id, "Highlight", i, f"{i}-{i + 1}", date_added, f"Quote {i}")
+    conn.commit()
+    expected = [h.id for h in get_highlights_for_book(conn, book_id)]
+
+    for limit in (1, 2, 3, 7, 10):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = get_highlights_for_book_page(conn, book_id, cursor, limit=limit)
+            assert len(page) <= limit
+            seen += [h.id for h in page]
+            if cursor is None:
+                break
+        assert seen == expected
+
+def test_search_highlights_page(conn):
+    book_id = insert_book(conn, "Search Paging", "Author")
+    for i in range(7):
+        insert_highlight(conn, book_id, "Highlight", i, f"{i}-{i + 1}", "2024-01-01", "word " * (i % 3 + 1) + "filler " * i)
+    conn.commit()
+    expected = [h.id for h, _ in search_highlights(conn, "word")]
+    assert len(expected) == 7
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = search_highlights_page(conn, "word", cursor, limit=2)
+        seen += [h.id for h, _ in page]
+        if cursor is None:
+            break
+    assert seen == expected
+
+def test_decode_cursor_rejects_garbage():
+    assert decode_cursor(None) is None
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+    for values in ([[1], {}], ["2024-01-01", "7"], [None, True], [None, 1.5]):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(*values))
+    assert decode_cursor(encode_cursor("2024-01-01", 7)) == ("2024-01-01", 7)
+    assert decode_cursor(encode_cursor(-1.25, 7)) == (-1.25, 7)
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+
+def test_connect_applies_pragmas(tmp_path):
+    conn = connect(str(tmp_path / "pragmas.db"))
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    conn.close()
+
+def test_connection_pool_reuses_connections(tmp_path):
+    db_path = str(tmp_path / "pool.db")
+    first = acquire_connection(db_path)
+    second = acquire_connection(db_path)
+    assert first is not second
+
+    first.execute("CREATE TABLE t (x)")
+    first.execute("INSERT INTO t VALUES (1)")  # left uncommitted
+    release_connection(first, db_path)
+    release_connection(second, db_path)
+
+    reused = acquire_connection(db_path)
+    assert reused is second
+    assert acquire_connection(db_path) is first
+    # The uncommitted insert was rolled back on release
+    assert first.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+    release_connection(first, db_path)
+    release_connection(reused, db_path)
+    close_connections(db_path)
+    assert acquire_connection(db_path) not in (first, reused)
+
+def test_location_range():
+    assert location_range("6982-6984") == (6982, 6984)
+    assert location_range("1234") == (1234, 1234)
+    assert location_range(None) is None
+    assert location_range("abc") is None
+
+def test_location_columns(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    insert_highlight(conn, book_id, "Highlight", 1, "100-120", "2024-01-01", "Quote")
+    insert_highlight(conn, book_id, "Note", 1, "130", "2024-01-01", "Note")
+    rows = conn.execute("SELECT location, loc_start, loc_end FROM highlights ORDER BY loc_start").fetchall()
+    assert rows == [("100-120", 100, 120), ("130", 130, 130)]
+
+def test_location_columns_added_to_existing_database():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""
+        CREATE TABLE highlights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, book_id INTEGER NOT NULL, highlight_type TEXT,
+            page INTEGER, location TEXT NOT NULL, date_added TEXT, quote TEXT NOT NULL,
+            UNIQUE(book_id, location)
+        )
+    """)
+    conn.execute("INSERT INTO highlights (book_id, location, quote) VALUES (1, '5-9', 'Old')")
+    create_tables(conn)
+    assert conn.execute("SELECT loc_start, loc_end FROM highlights").fetchone() == (5, 9)
+    conn.close()
+
+def test_import_highlights_collapses_extended_highlights(conn):
+    # An existing highlight with a tag, later extended on the Kindle
+    book_id = insert_book(conn, "Book", "Author")
+    old_id = insert_highlight(conn, book_id, "Highlight", 1, "100-105", "2024-01-01T00:00:00", "Short")
+    tag_id = insert_tag(conn, "Keep")
+    add_tag_to_highlight(conn, old_id, tag_id)
+
+    entries = [
+        make_entry("Book", "Author", "100-110", "2024-01-02T00:00:00", "Short and longer"),
+        make_entry("Book", "Author", "200-210", "2024-01-02T00:00:00", "Elsewhere"),
+        # Extended twice within the same import; the middle one never reaches the table
+        make_entry("Book", "Author", "300-305", "2024-01-03T00:00:00", "A"),
+        make_entry("Book", "Author", "300-308", "2024-01-04T00:00:00", "A b"),
+        make_entry("Book", "Author", "299-309", "2024-01-05T00:00:00", "Z a b c"),
+        # An older clipping of the same passage than the one stored, so dropped
+        make_entry("Book", "Author", "101-103", "2024-01-01T00:00:00", "Short and"),
+    ]
+    inserted, skipped = import_highlights(conn, entries, batch_size=2)
+    assert inserted + skipped == len(entries)
+
+    highlights = get_highlights_for_book_with_tags(conn, book_id)
+    assert sorted((h.location, h.quote) for h in highlights) == [
+        ("100-110", "Short and longer"),
+        ("200-210", "Elsewhere"),
+        ("299-309", "Z a b c"),
+    ]
+    extended = next(h for h in highlights if h.location == "100-110")
+    assert extended.id == old_id
+    assert [t.name for t in extended.tags] == ["Keep"]
+    assert [h.quote for h, _ in search_highlights(conn, "longer")] == ["Short and longer"]
+    assert [h.quote for h, _ in search_highlights(conn, "short")] == ["Short and longer"]
+
+def test_import_highlights_merges_several_overlaps(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    first = insert_highlight(conn, book_id, "Highlight", 1, "10-12", "2024-01-01", "One")
+    second = insert_highlight(conn, book_id, "Highlight", 1, "14-16", "2024-01-01", "Two")
+    tag_id = insert_tag(conn, "Second")
+    add_tag_to_highlight(conn, second, tag_id)
+    insert_highlight(conn, book_id, "Note", 1, "11", "2024-01-01", "A note is never collapsed")
+    conn.commit()
+
+    assert import_highlights(conn, [make_entry("Book", "Author", "10-16", "2024-01-02", "One and two")]) == (1, 0)
+    highlights = get_highlights_for_book_with_tags(conn, book_id)
+    assert sorted(h.quote for h in highlights) == ["A note is never collapsed", "One and two"]
+    merged = next(h for h in highlights if h.quote == "One and two")
+    assert merged.id in (first, second)
+    assert [t.name for t in merged.tags] == ["Second"]
+
+def stats_from_scratch(conn):
+    return conn.execute("""
+        SELECT b.id, COUNT(h.id), MAX(h.date_added)
+        FROM books b LEFT JOIN highlights h ON b.id = h.book_id
+        GROUP BY b.id ORDER BY b.id
+    """).fetchall()
+
+def materialized_stats(conn):
+    return conn.execute("SELECT book_id, highlight_count, last_highlight_date FROM book_stats ORDER BY book_id").fetchall()
+
+def test_book_stats_follow_writes(conn):
+    book1 = insert_book(conn, "One", "Author")
+    book2 = insert_book(conn, "Two", "Author")
+    assert materialized_stats(conn) == [(book1, 0, None), (book2, 0, None)]
+
+    h1 = insert_highlight(conn, book1, "Highlight", 1, "1-2", "2024-01-01", "A")
+    h2 = insert_highlight(conn, book1, "Highlight", 1, "3-4", "2024-03-01", "B")
+    insert_highlight(conn, book1, "Highlight", 1, "5-6", None, "Undated")
+    insert_highlight(conn, book2, "Highlight", 1, "1-2", "2024-02-01", "C")
+    assert materialized_stats(conn) == stats_from_scratch(conn)
+
+    conn.execute("DELETE FROM highlights WHERE id = ?", (h2,))
+    assert materialized_stats(conn) == [(book1, 2, "2024-01-01"), (book2, 1, "2024-02-01")]
+
+    conn.execute("UPDATE highlights SET date_added = '2024-05-01' WHERE id = ?", (h1,))
+    conn.execute("UPDATE highlights SET book_id = ? WHERE quote = 'Undated'", (book2,))
+    assert materialized_stats(conn) == stats_from_scratch(conn)
+
+    # Collapsing an extended highlight goes through the same triggers
+    import_highlights(conn, [make_entry("Two", "Author", "1-3", "2024-06-01", "C extended")])
+    assert materialized_stats(conn) == stats_from_scratch(conn)
+    assert [b.title for b in get_books_with_stats(conn)] == ["Two", "One"]
+
+def test_book_stats_backfilled_for_existing_database(conn):
+    book_id = insert_book(conn, "Old", "Author")
+    insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01", "A")
+    conn.execute("DROP TABLE book_stats")
+    conn.execute("PRAGMA user_version = 0")  # as before schema versioning
+    conn.commit()
+    create_tables(conn)
+    assert materialized_stats(conn) == [(book_id, 1, "2024-01-01")]
+
+def test_get_tags_with_counts(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    highlight_ids = [insert_highlight(conn, book_id, "Highlight", i, f"{i}-{i}", "2024-01-01", f"Q{i}") for i in range(3)]
+    busy = insert_tag(conn, "Busy")
+    unused = insert_tag(conn, "Alpha unused")
+    single = insert_tag(conn, "Single")
+    for highlight_id in highlight_ids:
+        add_tag_to_highlight(conn, highlight_id, busy)
+    add_tag_to_highlight(conn, highlight_ids[0], single)
+
+    tags = get_tags_with_counts(conn)
+    assert [(t.id, t.name, t.highlight_count) for t in tags] == [
+        (unused, "Alpha unused", 0),
+        (busy, "Busy", 3),
+        (single, "Single", 1),
+    ]
+    assert count_queries(conn, get_tags_with_counts) == 1
+
+def test_generation_bumped_by_writes(conn):
+    assert get_generation(conn) == (0, None)
+    import_highlights(conn, [make_entry("Dune", "Frank Herbert", "1-2", "2024-01-01T00:00:00", "Fear")])
+    generation, modified = get_generation(conn)
+    assert generation == 1 and modified > 0
+
+    # Re-importing the same highlight changes nothing
+    import_highlights(conn, [make_entry("Dune", "Frank Herbert", "1-2", "2024-01-01T00:00:00", "Fear")])
+    assert get_generation(conn)[0] == 1
+
+    highlight_id = get_highlights_for_book(conn, 1)[0].id
+    tag_id = insert_tag(conn, "classic")
+    update_tag(conn, tag_id, "classics")
+    add_tag_to_highlight(conn, highlight_id, tag_id)
+    remove_tag_from_highlight(conn, highlight_id, tag_id)
+    set_tags_for_highlight(conn, highlight_id, [tag_id])
+    delete_tag(conn, tag_id)
+    assert get_generation(conn)[0] == 7
+
+    # No-op writes leave it alone
+    assert not remove_tag_from_highlight(conn, highlight_id, tag_id)
+    assert not delete_tag(conn, tag_id)
+    assert get_generation(conn)[0] == 7
+
+def test_set_tags_for_highlight(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    highlight_id = insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Quote")
+    first, second, third = (insert_tag(conn, name) for name in ("a", "b", "c"))
+    set_tags_for_highlight(conn, highlight_id, [first, second])
+    set_tags_for_highlight(conn, highlight_id, [second, third, third])
+    assert [t.id for t in get_tags_for_highlight(conn, highlight_id)] == [second, third]
+
+ORIGINAL_SCHEMA = """
+    CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author TEXT NOT NULL, UNIQUE(title, author));
+    CREATE TABLE highlights (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, book_id INTEGER NOT NULL, highlight_type TEXT, page INTEGER,
+        location TEXT NOT NULL, date_added TEXT, quote TEXT NOT NULL,
+        FOREIGN KEY(book_id) REFERENCES books(id), UNIQUE(book_id, location));
+    CREATE TABLE tags (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL);
+    CREATE TABLE highlight_tags (highlight_id INTEGER, tag_id INTEGER, PRIMARY KEY(highlight_id, tag_id));
+    CREATE TABLE import_metadata (key TEXT PRIMARY KEY, value TEXT);
+    INSERT INTO books (title, author) VALUES ('Dune', 'Frank Herbert');
+    INSERT INTO highlights (book_id, highlight_type, page, location, date_added, quote)
+    VALUES (1, 'Highlight', 1, '10-12', '2024-01-01T00:00:00', 'Fear is the mind-killer.');
+"""
+
+def test_migrate_runs_ddl_once():
+    conn = sqlite3.connect(':memory:')
+    assert migrate(conn) == SCHEMA_VERSION
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert 'highlights' in [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    assert migrate(conn) == 0
+    assert count_queries(conn, migrate) == 1
+    conn.close()
+
+def test_migrate_upgrades_original_database():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(ORIGINAL_SCHEMA)
+    assert migrate(conn) == SCHEMA_VERSION
+    assert [b.highlight_count for b in get_books_with_stats(conn)] == [1]
+    assert [h.quote for h, _ in search_highlights(conn, "fear")] == ["Fear is the mind-killer."]
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {'idx_highlights_book_date', 'idx_highlight_tags_tag', 'idx_highlights_book_location'} <= indexes
+    conn.close()
+
+def test_migrate_applies_only_missing_steps():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(ORIGINAL_SCHEMA)
+    migrate(conn)
+    conn.execute("DROP INDEX idx_highlights_book_date")
+    conn.execute("PRAGMA user_version = 1")
+    assert migrate(conn) == SCHEMA_VERSION - 1
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_highlights_book_date'").fetchone()
+    conn.close()
+
+def test_migrate_refuses_newer_database():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+    conn.close()
+
+def query_plans(conn, func, *args):
+    """Run func and return (sql, plan details) for each SELECT it executed."""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        func(conn, *args)
+    finally:
+        conn.set_trace_callback(None)
+    return [
+        (sql, [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)])
+        for sql in statements if sql.lstrip().upper().startswith('SELECT')
+    ]
+
+# The importer loads every book into a map once, instead of a lookup per entry
+INTENTIONAL_SCANS = {"SELECT id, title, author FROM books"}
+
+@pytest.mark.parametrize('query', [
+    lambda conn: get_books_with_stats(conn),
+    lambda conn: get_book_by_id(conn, 1),
+    lambda conn: get_highlights_for_book_page(conn, 1),
+    lambda conn: get_highlights_for_book(conn, 1, limit=10, after=("2024-01-01T00:00:00", 5)),
+    lambda conn: search_highlights_page(conn, "fear"),
+    lambda conn: get_highlights_for_tag(conn, 1),
+    lambda conn: get_tag_by_id(conn, 1),
+    lambda conn: get_tags_for_highlight(conn, 1),
+    lambda conn: get_all_tags(conn),
+    lambda conn: get_generation(conn),
+    lambda conn: get_highlights_by_ids(conn, [1]),
+    lambda conn: list(iter_highlight_quotes(conn, 0)),
+    lambda conn: get_highlight_quotes(conn, [1]),
+    lambda conn: get_highlight_changes(conn, 0),
+    lambda conn: fuzzy_search_highlights(conn, "fera"),
+    lambda conn: import_highlights(conn, [make_entry("Dune", "Frank Herbert", "11-14", "2024-02-01T00:00:00", "Fear is")]),
+])
+def test_hot_queries_use_indexes(conn, query):
+    book_id = insert_book(conn, "Dune", "Frank Herbert")
+    highlight_id = insert_highlight(conn, book_id, "Highlight", 1, "10-12", "2024-01-01T00:00:00", "Fear is the mind-killer.")
+    add_tag_to_highlight(conn, highlight_id, insert_tag(conn, "classics"))
+    plans = query_plans(conn, query)
+    assert plans
+    for sql, details in plans:
+        if sql in INTENTIONAL_SCANS:
+            continue
+        for detail in details:
+            # A plain "SCAN <table>" reads every row; index scans and FTS lookups say how they search
+            assert not (detail.startswith('SCAN') and 'INDEX' not in detail), (sql, details)
+
+def test_tag_counts_scan_only_tags(conn):
+    # Listing every tag has to visit every tag, but not every highlight_tags row
+    [(sql, details)] = query_plans(conn, get_tags_with_counts)
+    assert [d for d in details if d.startswith('SCAN')] == ['SCAN t']
+    assert any('idx_highlight_tags_tag' in d for d in details)
+
+def test_listing_iterators_are_lazy(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    for i in range(3):
+        insert_highlight(conn, book_id, "Highlight", i, f"{i}-{i}", f"2024-01-0{i + 1}T00:00:00", f"Q{i}")
+    tag_id = insert_tag(conn, "Tag")
+    add_tag_to_highlight(conn, 1, tag_id)
+
+    highlights = iter_highlights_for_book(conn, book_id)
+    assert not isinstance(highlights, list)
+    first = next(highlights)
+    assert (first.quote, first.book_id, list(first.tags)) == ("Q2", book_id, [])
+    assert [h.quote for h in highlights] == ["Q1", "Q0"]
+
+    [book] = iter_books_with_stats(conn)
+    assert (book.title, book.highlight_count) == ("Book", 3)
+    [(highlight, book)] = iter_highlights_for_tag(conn, tag_id)
+    assert (highlight.id, book.id, book.title) == (1, book_id, "Book")
+
+def test_highlight_changes_are_logged(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    first = insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Old")
+    second = insert_highlight(conn, book_id, "Highlight", 2, "3-4", "2024-01-02T00:00:00", "Gone")
+    conn.execute("UPDATE highlights SET page = 5 WHERE id = ?", (first,))  # quote unchanged: not logged
+    assert get_highlight_changes(conn) == (0, set())
+    conn.execute("UPDATE highlights SET quote = 'New' WHERE id = ?", (first,))
+    conn.execute("DELETE FROM highlights WHERE id = ?", (second,))
+    last_seq, changed = get_highlight_changes(conn)
+    assert changed == {first, second}
+    assert get_highlight_changes(conn, last_seq) == (last_seq, set())
+    assert get_highlight_quotes(conn, [first, second]) == [(first, "New")]
+
+def test_get_highlights_by_ids_keeps_order(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    ids = [insert_highlight(conn, book_id, "Highlight", i, f"{i}-{i}", None, f"Q{i}") for i in range(3)]
+    add_tag_to_highlight(conn, ids[2], insert_tag(conn, "Tag"))
+    pairs = get_highlights_by_ids(conn, [ids[2], 99, ids[0]])
+    assert [(h.quote, b.title) for h, b in pairs] == [("Q2", "Book"), ("Q0", "Book")]
+    assert [t.name for t in pairs[0][0].tags] == ["Tag"]
+    assert list(iter_highlight_quotes(conn, ids[0])) == [(ids[1], "Q1"), (ids[2], "Q2")]
+
+@pytest.fixture
+def fuzzy_conn(conn):
+    import_highlights(conn, [
+        make_entry("Dune", "Frank Herbert", "10-12", "2024-01-01T00:00:00", "Fear is the mind-killer."),
+        make_entry("Dune", "Frank Herbert", "20-22", "2024-01-02T00:00:00", "The spice must flow."),
+        make_entry("Émile", "Jean-Jacques Rousseau", "5-6", "2024-01-03T00:00:00", "Nature never deceives us."),
+    ])
+    return conn
+
+def test_search_words_match_the_index_tokenizer():
+    assert search_words("Mind-killer, Émile's_café") == ["mind", "killer", "emile", "s", "cafe"]
+
+def test_trigram_similarity():
+    assert trigram_similarity("herbert", "herbert") == 1
+    assert trigram_similarity("herbret", "herbert") > 0.3
+    assert trigram_similarity("spice", "nature") == 0
+
+def test_edit_distance():
+    assert edit_distance("spice", "spice") == 0
+    assert edit_distance("spcie", "spice") == 1  # adjacent letters swapped
+    assert edit_distance("kiler", "killer") == 1
+    assert edit_distance("", "abc") == 3
+
+def test_search_terms_follow_imports(fuzzy_conn):
+    terms = {row[0] for row in fuzzy_conn.execute("SELECT term FROM search_terms")}
+    assert {"herbert", "killer", "emile", "rousseau", "deceives"} <= terms
+    assert "is" not in terms  # too short to correct
+    assert suggest_terms(fuzzy_conn, "herbret")[0] == "herbert"
+    assert suggest_terms(fuzzy_conn, "spcie") == ["spice"]  # shares no inner trigram with it
+    assert suggest_terms(fuzzy_conn, "xyzzy") == []
+
+def test_search_terms_backfilled_from_index(conn):
+    book_id = insert_book(conn, "Dune", "Frank Herbert")
+    insert_highlight(conn, book_id, "Highlight", 1, "10-12", "2024-01-01T00:00:00", "Fear is the mind-killer.")
+    conn.execute("DROP TABLE search_terms")
+    conn.execute("DROP TABLE search_terms_trigram")
+    conn.execute("PRAGMA user_version = 4")
+    migrate(conn)
+    assert suggest_terms(conn, "kiler") == ["killer"]
+
+def test_fuzzy_search_corrects_misspelled_words(fuzzy_conn):
+    assert search_highlights(fuzzy_conn, "herbret") == []
+    results, corrections = fuzzy_search_highlights(fuzzy_conn, "herbret")
+    assert {h.quote for h, _ in results} == {"Fear is the mind-killer.", "The spice must flow."}
+    assert corrections.split()[0] == "herbert"
+
+    results, corrections = fuzzy_search_highlights(fuzzy_conn, "fear the mind kiler")
+    assert [h.quote for h, _ in results] == ["Fear is the mind-killer."]
+    assert all(h.tags == [] for h, _ in results)
+
+    # Accents and misspellings together, and a word with no close spelling at all
+    results, _ = fuzzy_search_highlights(fuzzy_conn, "emil natures")
+    assert [b.title for _, b in results] == ["Émile"]
+    assert fuzzy_search_highlights(fuzzy_conn, "xyzzy") == ([], None)
+
+def test_fuzzy_search_falls_back_to_any_word(fuzzy_conn):
+    # No highlight has both words, so those with either one are returned
+    results, _ = fuzzy_search_highlights(fuzzy_conn, "spise rousseu")
+    assert {h.quote for h, _ in results} == {"The spice must flow.", "Nature never deceives us."}
+
+def test_import_highlights_keeps_neighbours_sharing_a_location(conn):
+    # Kindle locations are coarse, so consecutive sentences often share one
+    book_id = insert_book(conn, "Book", "Author")
+    first = insert_highlight(conn, book_id, "Highlight", 1, "100-102", "2024-01-01T00:00:00", "First sentence of the page.")
+    tag_id = insert_tag(conn, "Keep")
+    add_tag_to_highlight(conn, first, tag_id)
+    conn.commit()
+
+    entries = [make_entry("Book", "Author", "102-104", "2024-01-02T00:00:00", "A completely different following sentence.")]
+    assert import_highlights(conn, entries) == (1, 0)
+    highlights = get_highlights_for_book_with_tags(conn, book_id)
+    assert sorted((h.location, h.quote) for h in highlights) == [
+        ("100-102", "First sentence of the page."),
+        ("102-104", "A completely different following sentence."),
+    ]
+    assert [t.name for t in next(h for h in highlights if h.id == first).tags] == ["Keep"]
+
+def test_import_highlights_collapses_overlaps_stored_before_collapsing(conn):
+    # Libraries imported before overlaps were collapsed can hold nested ranges
+    book_id = insert_book(conn, "Book", "Author")
+    insert_highlight(conn, book_id, "Highlight", 1, "100-200", "2024-01-01T00:00:00", "Fear is")
+    insert_highlight(conn, book_id, "Highlight", 1, "150-160", "2024-01-01T00:00:00", "Fear is the mind")
+    conn.commit()
+
+    entries = [make_entry("Book", "Author", "170-180", "2024-01-02T00:00:00", "Fear is the mind-killer.")]
+    assert import_highlights(conn, entries) == (1, 0)
+    # 100-200 is found past 150-160, which ends before the new range starts
+    assert sorted((h.location, h.quote) for h in get_highlights_for_book(conn, book_id)) == [
+        ("150-160", "Fear is the mind"),
+        ("170-180", "Fear is the mind-killer."),
+    ]
+
+def test_import_highlights_keeps_old_highlight_when_new_location_is_taken(conn):
+    book_id = insert_book(conn, "Book", "Author")
+    insert_highlight(conn, book_id, "Highlight", 1, "100-105", "2024-01-01T00:00:00", "alpha beta gamma")
+    insert_highlight(conn, book_id, "Highlight", 1, "100-110", "2024-01-01T00:00:00", "zeta eta theta")
+    conn.commit()
+
+    entries = [make_entry("Book", "Author", "100-110", "2024-01-02T00:00:00", "alpha beta gamma delta")]
+    assert import_highlights(conn, entries) == (0, 1)
+    assert sorted((h.location, h.quote) for h in get_highlights_for_book(conn, book_id)) == [
+        ("100-105", "alpha beta gamma"),
+        ("100-110", "zeta eta theta"),
+    ]
+
+def test_import_highlights_keeps_queued_highlight_when_new_location_is_taken(conn):
+    entries = [
+        make_entry("Book", "Author", "100-105", "2024-01-01T00:00:00", "alpha beta gamma"),
+        make_entry("Book", "Author", "100-110", "2024-01-01T00:00:00", "zeta eta theta"),
+        make_entry("Book", "Author", "100-110", "2024-01-02T00:00:00", "alpha beta gamma delta"),
+    ]
+    assert import_highlights(conn, entries) == (2, 1)
+    [book] = get_books_with_stats(conn)
+    assert sorted((h.location, h.quote) for h in get_highlights_for_book(conn, book.id)) == [
+        ("100-105", "alpha beta gamma"),
+        ("100-110", "zeta eta theta"),
+    ]
+
+def test_location_index_tracks_largest_end():
+    from database import _index_insert, _index_remove, _find_overlaps
+    index = ([], [], [])
+    for start, end in [(100, 200), (150, 160), (300, 310)]:
+        _index_insert(index, (start, end, f"{start}-{end}", '', ''))
+    assert index[2] == [200, 200, 310]
+    assert _find_overlaps(index, 170, 180) == [0]
+    assert _find_overlaps(index, 155, 305) == [2, 1, 0]
+    _index_remove(index, 0)
+    assert index[2] == [160, 310]
+    assert _find_overlaps(index, 170, 180) == []
@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+import sqlite3
+import pytest
+import export
+from database import create_tables, insert_book, insert_highlight, insert_tag, add_tag_to_highlight
+from export import export_library, iter_csv, parse_args
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    dune = insert_book(conn, "Dune", "Frank Herbert")
+    emma = insert_book(conn, "Emma", "Jane Austen")
+    first = insert_highlight(conn, dune, "Highlight", 1, "10-12", "2024-01-02T00:00:00", "Fear is the mind-killer.")
+    insert_highlight(conn, dune, "Note", None, "20", "2024-03-01T00:00:00", "Line one\nLine two")
+    insert_highlight(conn, emma, "Highlight", 5, "50-51", "2024-02-01T00:00:00", 'She said "hello", then left.')
+    add_tag_to_highlight(conn, first, insert_tag(conn, "fear"))
+    conn.execute("UPDATE highlights SET color = 'Yellow', note = 'Litany' WHERE id = ?", (first,))
+    conn.commit()
+    yield conn
+    conn.close()
+
+def export_text(conn, fmt, **filters):
+    return ''.join(export_library(conn, fmt, **filters))
+
+def test_csv_export(conn):
+    rows = list(csv.DictReader(io.StringIO(export_text(conn, 'csv'))))
+    assert [(r['book'], r['quote']) for r in rows] == [
+        ("Dune", "Fear is the mind-killer."),
+        ("Dune", "Line one\nLine two"),
+        ("Emma", 'She said "hello", then left.'),
+    ]
+    assert rows[0]['tags'] == "fear"
+    assert (rows[0]['id'], rows[0]['color'], rows[0]['note']) == ("1", "Yellow", "Litany")
+    assert (rows[1]['page'], rows[1]['color'], rows[1]['note']) == ("", "", "")
+
+def test_ndjson_export(conn):
+    lines = export_text(conn, 'ndjson').splitlines()
+    records = [json.loads(line) for line in lines]
+    assert len(records) == 3
+    assert records[0]['book'] == {'id': 1, 'title': "Dune", 'author': "Frank Herbert"}
+    assert records[0]['tags'] == ["fear"]
+
+def test_markdown_export(conn):
+    text = export_text(conn, 'markdown')
+    assert text.startswith("## Dune\n\n*Frank Herbert*\n\n> Fear is the mind-killer.\n\n— Highlight, page 1, location 10-12, added 2024-01-02 `fear`\n\n")
+    assert "> Line one\n> Line two\n" in text
+    assert "\n## Emma\n" in text
+
+def test_export_filters(conn):
+    def quotes(**filters):
+        return [json.loads(line)['quote'] for line in export_text(conn, 'ndjson', **filters).splitlines()]
+
+    assert quotes(book_id=2) == ['She said "hello", then left.']
+    assert quotes(tag_id=1) == ["Fear is the mind-killer."]
+    assert quotes(since="2024-02-01") == ["Line one\nLine two", 'She said "hello", then left.']
+    assert quotes(before="2024-02-01") == ["Fear is the mind-killer."]
+    assert quotes(book_id=99) == []
+
+def test_export_rejects_bad_arguments(conn):
+    with pytest.raises(ValueError):
+        export_library(conn, 'xml')
+    with pytest.raises(ValueError):
+        export_library(conn, 'csv', since="last tuesday")
+
+def test_export_streams_in_chunks(conn, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 1)
+    chunks = list(export_library(conn, 'csv'))
+    assert len(chunks) == 4  # header plus one row each
+
+def test_iter_csv_of_parsed_entries():
+    from parser import parse_clippings
+    from test_parser import TWO_ENTRIES
+    text = ''.join(iter_csv((highlight, book) for book, highlight in parse_clippings(TWO_ENTRIES)))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert rows[0]['book'] == "Churchill"
+    assert rows[0]['tags'] == ""
+
+def test_parse_args():
+    args = parse_args(['--format', 'markdown', '--tag-id', '3', '--output', 'out.md'])
+    assert (args.format, args.tag_id, args.output) == ('markdown', 3, 'out.md')
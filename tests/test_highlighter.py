@@ -0,0 +1,45 @@
+import pytest
+from app.highlighter import compile_query, highlight, snippet
+
+def test_highlight_marks_every_term():
+    result = highlight("Fear is the mind-killer. Fear is the little-death.", "fear little")
+    assert result == "<mark>Fear</mark> is the mind-killer. <mark>Fear</mark> is the <mark>little</mark>-death."
+
+def test_highlight_prefix_and_phrase():
+    assert highlight("Strategy and strategic thinking", "strat") == "<mark>Strategy</mark> and <mark>strategic</mark> thinking"
+    # Phrases match across punctuation, like the FTS tokenizer
+    assert highlight("the mind-killer, the mind", '"mind killer"') == "the <mark>mind-killer</mark>, the mind"
+    # Words only match from their start
+    assert highlight("bear", "ear") == "bear"
+
+def test_highlight_escapes_html():
+    result = highlight('<script>alert("x")</script> & fear', "script fear")
+    assert result == '&lt;<mark>script</mark>&gt;alert(&#34;x&#34;)&lt;/<mark>script</mark>&gt; &amp; <mark>fear</mark>'
+    assert highlight("<b>", "") == "&lt;b&gt;"
+
+def test_compile_query_is_cached():
+    assert compile_query("fear mind") is compile_query("fear mind")
+    assert compile_query('" - "') is None
+
+def test_snippet_short_text_is_whole():
+    assert snippet("A short fear.", "fear") == "A short <mark>fear</mark>."
+
+def test_snippet_trims_around_matches():
+    text = " ".join(f"word{i}" for i in range(200)) + " needle " + " ".join(f"tail{i}" for i in range(200))
+    result = snippet(text, "needle", max_length=100, context=20)
+    assert result.startswith("…") and result.endswith("…")
+    assert "<mark>needle</mark>" in result
+    assert len(result) < 100
+    assert "word0 " not in result
+
+def test_snippet_merges_and_limits_fragments():
+    text = " ".join(["filler"] * 50 + ["alpha", "beta"] + ["filler"] * 50 + ["alpha"] + ["filler"] * 50 + ["alpha"] + ["filler"] * 50)
+    result = snippet(text, "alpha beta", max_length=50, context=10, max_fragments=2)
+    assert result.count("<mark>alpha</mark>") == 2
+    assert "<mark>beta</mark>" in result
+    assert result.count(" … ") == 1
+
+def test_snippet_without_match_shows_start():
+    text = "word " * 100
+    result = snippet(text, "elsewhere", max_length=20)
+    assert result == "word word word word…"
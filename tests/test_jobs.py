@@ -0,0 +1,104 @@
+import sys
+import threading
+import pytest
+from app import jobs
+from database import connect, create_tables, get_books_with_stats, get_last_import_date, set_last_import_date
+from synthetic import write_clippings
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = str(tmp_path / 'bookmarker.db')
+    conn = connect(db_path)
+    create_tables(conn)
+    conn.close()
+    return db_path
+
+def test_start_import_runs_in_background(db_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'PROGRESS_INTERVAL', 10)
+    upload = open(write_clippings(str(tmp_path / 'upload.txt'), 300, notes=0), 'rb')
+    job = jobs.start_import(db_path, upload, 'My Clippings.txt')
+    assert job.completed.wait(10)
+
+    progress = job.to_dict()
+    assert progress['status'] == 'done'
+    assert progress['parsed'] == 300
+    assert progress['inserted'] + progress['skipped'] == 300
+    assert progress['bytes_read'] == progress['total_bytes']
+    assert progress['rate'] > 0 and progress['eta'] is None
+    assert jobs.get_job(job.id) is job
+    assert jobs.current_job() is None
+    assert upload.closed
+
+    conn = connect(db_path)
+    assert sum(book.highlight_count for book in get_books_with_stats(conn)) == progress['inserted']
+    assert get_last_import_date(conn) is not None
+    conn.close()
+
+def test_import_ignores_last_import_date(db_path, tmp_path):
+    # Clippings dated before the last import are imported too; duplicates are skipped anyway
+    conn = connect(db_path)
+    set_last_import_date(conn, "2999-01-01T00:00:00")
+    conn.close()
+    job = jobs.start_import(db_path, open(write_clippings(str(tmp_path / 'upload.txt'), 10, notes=0), 'rb'), 'upload.txt')
+    assert job.completed.wait(10)
+    assert job.status == 'done'
+    assert job.inserted > 0
+
+def test_only_one_import_at_a_time(db_path, tmp_path, monkeypatch):
+    release = threading.Event()
+    real_import = jobs.import_highlights
+
+    def slow_import(*args, **kwargs):
+        release.wait(10)
+        return real_import(*args, **kwargs)
+
+    monkeypatch.setattr(jobs, 'import_highlights', slow_import)
+    first = jobs.start_import(db_path, open(write_clippings(str(tmp_path / 'first.txt'), 10), 'rb'), 'first.txt')
+    second_upload = open(write_clippings(str(tmp_path / 'second.txt'), 10), 'rb')
+    assert jobs.start_import(db_path, second_upload, 'second.txt') is None
+    assert jobs.current_job() is first
+    assert not second_upload.closed
+
+    release.set()
+    assert first.completed.wait(10)
+    second = jobs.start_import(db_path, second_upload, 'second.txt')
+    assert second.completed.wait(10)
+    assert second.status == 'done'
+
+def test_failed_import_reports_error(db_path, tmp_path, monkeypatch):
+    def broken_import(*args, **kwargs):
+        raise RuntimeError("disk on fire")
+
+    monkeypatch.setattr(jobs, 'import_highlights', broken_import)
+    job = jobs.start_import(db_path, open(write_clippings(str(tmp_path / 'upload.txt'), 10), 'rb'), 'upload.txt')
+    assert job.completed.wait(10)
+    assert job.status == 'failed'
+    assert job.to_dict()['error'] == "disk on fire"
+    assert jobs.current_job() is None
+
+def test_index_failure_does_not_fail_the_import(db_path, tmp_path, monkeypatch):
+    import related
+
+    def broken_update_index(conn, db_path):
+        raise MemoryError("index too big")
+
+    monkeypatch.setattr(related, 'update_index', broken_update_index)
+    job = jobs.start_import(db_path, open(write_clippings(str(tmp_path / 'upload.txt'), 10), 'rb'), 'upload.txt')
+    assert job.completed.wait(10)
+    progress = job.to_dict()
+    assert progress['status'] == 'done'
+    assert progress['error'] is None
+    assert progress['index_error'] == "index too big"
+    assert progress['inserted'] + progress['skipped'] == 10
+
+def test_lock_released_when_parser_cannot_be_imported(db_path, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'parser', None)  # makes the import raise ImportError
+    job = jobs.start_import(db_path, open(write_clippings(str(tmp_path / 'upload.txt'), 10), 'rb'), 'upload.txt')
+    assert job.completed.wait(10)
+    assert job.status == 'failed'
+    assert jobs.current_job() is None
+
+    monkeypatch.undo()
+    retry = jobs.start_import(db_path, open(write_clippings(str(tmp_path / 'retry.txt'), 10), 'rb'), 'retry.txt')
+    assert retry is not None and retry.completed.wait(10)
+    assert retry.status == 'done'
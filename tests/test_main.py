@@ -13,4 +13,76 @@ main.CLIPPINGS_FILE = 'My Clippings.txt'  # Use real file for now, but perhaps c
 def test_import_process():
     # This would test the full import, but since it uses real files, maybe skip or mock.
     # For now, since functions are tested, perhaps not necessary.
-    pass
\ No newline at end of file
+    pass
+
+from main import import_clippings
+from parser import last_entry_boundary
+from database import get_import_checkpoint
+import io
+
+ENTRY = """{title} (Author)
+- Your Highlight on page 1 | Location {loc} | Added on Sunday, November 10, 2024 11:21:35 AM
+
+Quote {loc}.
+==========
+"""
+
+def clippings(*locations, title="Book"):
+    return "".join(ENTRY.format(title=title, loc=loc) for loc in locations)
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    yield conn
+    conn.close()
+
+def test_import_clippings_resumes_at_checkpoint(conn, tmp_path):
+    path = tmp_path / "My Clippings.txt"
+    path.write_text('\ufeff' + clippings("1-2", "3-4"), encoding='utf-8')
+
+    assert import_clippings(conn, path) == (2, 0, 0)
+    size = path.stat().st_size
+    assert get_import_checkpoint(conn)['offset'] == size - 1  # before the trailing newline
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(clippings("5-6"))
+    # Only the appended entry is parsed, so nothing is skipped as a duplicate
+    assert import_clippings(conn, path) == (1, 0, size - 1)
+    assert get_books_with_stats(conn)[0].highlight_count == 3
+
+def test_import_clippings_reparses_unterminated_tail(conn, tmp_path):
+    path = tmp_path / "My Clippings.txt"
+    path.write_text(clippings("1-2") + clippings("3-4").rstrip("=\n"), encoding='utf-8')
+    assert import_clippings(conn, path)[:2] == (2, 0)
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("\n==========\n" + clippings("5-6"))
+    # The fragment after the last separator is read again and ignored as a duplicate
+    assert import_clippings(conn, path)[:2] == (1, 1)
+
+def test_import_clippings_falls_back_when_file_changes(conn, tmp_path):
+    path = tmp_path / "My Clippings.txt"
+    path.write_text(clippings("1-2", "3-4"), encoding='utf-8')
+    import_clippings(conn, path)
+
+    path.write_text(clippings("1-2", "3-4", title="Other Book"), encoding='utf-8')
+    assert import_clippings(conn, path) == (2, 0, 0)
+
+    path.write_text(clippings("1-2"), encoding='utf-8')  # truncated
+    assert import_clippings(conn, path) == (0, 1, 0)
+
+def test_last_entry_boundary():
+    data = clippings("1-2", "3-4").encode('utf-8') + b"partial"
+    expected = data.rindex(b"==========") + 10
+    for chunk_size in (1, 4, 9, 10, 11, 1000):
+        assert last_entry_boundary(io.BytesIO(data), len(data), chunk_size) == expected
+    assert last_entry_boundary(io.BytesIO(b"no separator"), 12) == 0
+
+def test_import_clippings_with_workers(conn, tmp_path):
+    path = tmp_path / "My Clippings.txt"
+    path.write_text(clippings(*[f"{i}-{i}" for i in range(1, 60, 2)]), encoding='utf-8')
+    assert import_clippings(conn, str(path), workers=2) == (30, 0, 0)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(clippings("100-101"))
+    assert import_clippings(conn, str(path), workers=2)[:2] == (1, 0)
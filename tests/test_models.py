@@ -27,4 +27,12 @@ def test_tag_creation():
 def test_highlight_tag_creation():
     ht = HighlightTag(highlight_id=2, tag_id=3, id=4)
     assert ht.highlight_id == 2
-    assert ht.tag_id == 3
\ No newline at end of file
+    assert ht.tag_id == 3
+
+def test_models_are_slotted():
+    highlight = Highlight(1, "Highlight", None, "1-2", None, "Quote")
+    assert list(highlight.tags) == []
+    for model in (highlight, Book("Title", "Author"), Tag("Tag")):
+        assert not hasattr(model, "__dict__")
+    with pytest.raises(AttributeError):
+        highlight.book = Book("Title", "Author")
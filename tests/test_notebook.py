@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import pytest
+from database import create_tables, get_books_with_stats, get_highlights_for_book, get_generation, import_highlights, insert_book, insert_highlight
+from notebook import (parse_highlight_header, parse_annotated_date, parse_notebook_html, notebook_location, iter_notebook_entries,
+                      import_notebook)
+
+NOTEBOOK_HTML = """
+<div id="kp-notebook-library">
+  <div id="B01" class="a-row kp-notebook-library-each-book">
+    <img class="kp-notebook-cover-image" src="https://example.com/dune.jpg">
+    <h2 class="a-size-base kp-notebook-searchable">Dune</h2>
+    <input type="hidden" id="kp-notebook-annotated-date-B01" value="Sunday November 10, 2024">
+    <p class="a-size-base kp-notebook-searchable">By: Frank Herbert</p>
+  </div>
+  <div id="B02" class="a-row kp-notebook-library-each-book">
+    <h2 class="a-size-base kp-notebook-searchable">Emma</h2>
+    <p class="a-size-base kp-notebook-searchable">By: Jane Austen</p>
+  </div>
+</div>
+<div id="kp-notebook-annotations-pane">
+  <h3 class="a-spacing-top-small kp-notebook-metadata">Dune</h3>
+  <p class="a-spacing-none kp-notebook-metadata">Frank Herbert</p>
+  <div id="kp-notebook-annotations">
+    <div class="a-row a-spacing-base">
+      <span id="annotationHighlightHeader">Yellow highlight | Location:&nbsp;120</span>
+      <div class="kp-notebook-highlight"><span id="highlight">Fear is the
+        mind-killer.</span></div>
+      <div id="note-"><span id="note">Litany against fear</span></div>
+    </div>
+    <div class="a-row a-spacing-base">
+      <span id="annotationHighlightHeader">Blue highlight | Page: 6</span>
+      <div class="kp-notebook-highlight"><span id="highlight">A beginning is <b>a very delicate</b> time.</span></div>
+      <div id="note-"><span id="note"></span></div>
+    </div>
+  </div>
+</div>
+"""
+
+SCRAPER_DATA = {
+    "Emma": {
+        "author": "Jane Austen",
+        "last_accessed": "Monday January 1, 2024",
+        "image_url": None,
+        "highlights": [
+            {"text": "First on page 3", "color": "Pink", "location_type": "Page", "location": "3", "note": ""},
+            {"text": "Second on page 3", "color": "Pink", "location_type": "Page", "location": "3", "note": "mine"},
+            {"text": "At a location", "color": "Yellow", "location_type": "Location", "location": "45", "note": None},
+        ],
+    }
+}
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    yield conn
+    conn.close()
+
+def test_parse_highlight_header():
+    assert parse_highlight_header("Yellow highlight | Page: 6") == ("Yellow", "Page", "6")
+    assert parse_highlight_header("Orange highlight | Location: 1,234") == ("Orange", "Location", "1,234")
+    assert parse_highlight_header("Note") == (None, None, None)
+
+def test_parse_annotated_date():
+    assert parse_annotated_date("Sunday November 10, 2024") == "2024-11-10T00:00:00"
+    assert parse_annotated_date("2024-11-10") == "2024-11-10T00:00:00"
+    assert parse_annotated_date("sometime") is None
+    assert parse_annotated_date(None) is None
+
+def test_parse_notebook_html():
+    data = parse_notebook_html(NOTEBOOK_HTML)
+    assert list(data) == ["Dune"]
+    dune = data["Dune"]
+    assert dune["author"] == "Frank Herbert"
+    assert dune["last_accessed"] == "Sunday November 10, 2024"
+    assert dune["image_url"] == "https://example.com/dune.jpg"
+    assert dune["highlights"] == [
+        {"text": "Fear is the mind-killer.", "color": "Yellow", "location_type": "Location", "location": "120", "note": "Litany against fear"},
+        {"text": "A beginning is a very delicate time.", "color": "Blue", "location_type": "Page", "location": "6", "note": None},
+    ]
+
+def test_parse_notebook_html_without_annotations():
+    assert parse_notebook_html("<html><body>Sign in</body></html>") == {}
+
+def test_iter_notebook_entries_page_locations():
+    entries = list(iter_notebook_entries(SCRAPER_DATA))
+    assert [(h.page, h.location, h.color, h.note) for _, h in entries] == [
+        (3, notebook_location("p3", "First on page 3"), "Pink", None),
+        (3, notebook_location("p3", "Second on page 3"), "Pink", "mine"),
+        (None, notebook_location("45", "At a location"), "Yellow", None),
+    ]
+    assert {book.title for book, _ in entries} == {"Emma"}
+    assert {h.date_added for _, h in entries} == {"2024-01-01T00:00:00"}
+
+def test_notebook_location_is_stable():
+    assert notebook_location("39", "Fear is the\n mind-killer.") == notebook_location("39", "Fear is the mind-killer.")
+    assert notebook_location("39", "Fear is the mind-killer.") != notebook_location("39", "I will face my fear.")
+    assert notebook_location("39", "Fear is the mind-killer.").startswith("39#")
+
+def notebook_data(last_accessed, *texts):
+    return {"Dune": {"author": "Frank Herbert", "last_accessed": last_accessed, "image_url": None, "highlights": [
+        {"text": text, "color": "Yellow", "location_type": "Location", "location": "39", "note": None} for text in texts
+    ]}}
+
+def test_highlights_sharing_a_location_are_all_kept(conn):
+    data = notebook_data("Monday January 1, 2024", "Fear is the mind-killer.", "I will face my fear.")
+    assert import_highlights(conn, iter_notebook_entries(data)) == (2, 0)
+    generation = get_generation(conn)
+    # A later scrape lists a new highlight first and has a newer last annotated date
+    data = notebook_data("Monday January 8, 2024", "A new one.", "Fear is the mind-killer.", "I will face my fear.")
+    assert import_highlights(conn, iter_notebook_entries(data)) == (1, 2)
+    assert import_highlights(conn, iter_notebook_entries(data)) == (0, 3)
+    [book] = get_books_with_stats(conn)
+    assert sorted(h.quote for h in get_highlights_for_book(conn, book.id)) == [
+        "A new one.", "Fear is the mind-killer.", "I will face my fear."]
+    assert get_generation(conn)[0] == generation[0] + 1
+
+def test_notebook_highlights_leave_clippings_alone(conn):
+    book_id = insert_book(conn, "Dune", "Frank Herbert")
+    insert_highlight(conn, book_id, "Highlight", 5, "1230-1236", "2019-11-10T00:00:00", "Fear is the mind-killer.")
+    conn.commit()
+    data = {"Dune": {"author": "Frank Herbert", "last_accessed": "Monday January 8, 2024", "image_url": None, "highlights": [
+        {"text": "Fear is the mind-killer.", "color": "Pink", "location_type": "Location", "location": "1234", "note": None},
+    ]}}
+    assert import_highlights(conn, iter_notebook_entries(data)) == (1, 0)
+    highlights = get_highlights_for_book(conn, book_id)
+    clipping = next(h for h in highlights if h.location == "1230-1236")
+    assert (clipping.page, clipping.date_added) == (5, "2019-11-10T00:00:00")
+
+    # Nor do later clippings collapse into the notebook highlight
+    from database import _load_location_index
+    assert [interval[2] for interval in _load_location_index(conn.cursor(), book_id)[1]] == ["1230-1236"]
+
+def test_import_notebook_is_idempotent(conn, tmp_path):
+    html_path = tmp_path / "dune.html"
+    html_path.write_text(NOTEBOOK_HTML, encoding='utf-8')
+    json_path = tmp_path / "highlights.json"
+    json_path.write_text(json.dumps(SCRAPER_DATA), encoding='utf-8')
+
+    assert import_notebook(conn, [str(html_path), str(json_path)]) == (5, 0)
+    assert import_notebook(conn, [str(html_path), str(json_path)]) == (0, 5)
+
+    books = {book.title: book for book in get_books_with_stats(conn)}
+    assert set(books) == {"Dune", "Emma"}
+    highlights = get_highlights_for_book(conn, books["Dune"].id)
+    assert {(h.location, h.color, h.note) for h in highlights} == {
+        (notebook_location("120", "Fear is the mind-killer."), "Yellow", "Litany against fear"),
+        (notebook_location("p6", "A beginning is a very delicate time."), "Blue", None),
+    }
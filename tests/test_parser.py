@@ -1,5 +1,7 @@
 import pytest
-from parser import parse_book_author, parse_highlight_info, parse_quote, parse_clippings
+from parser import parse_book_author, parse_highlight_info, parse_quote, parse_clippings, iter_clippings, parse_date_added, iter_clippings_parallel, split_ranges
+import io
+from synthetic import iter_clipping_texts
 import datetime
 
 def test_parse_book_author_with_author():
@@ -30,6 +32,29 @@ def test_parse_highlight_info_no_page():
     assert location == "1234-1235"
     assert date_added == datetime.datetime(2024, 1, 1, 12, 0, 0).isoformat()
 
+def test_parse_highlight_info_variants():
+    line = "- Your Bookmark on page 3 | Location 100 | Added on Friday, March 1, 2024 12:05:09 AM"
+    assert parse_highlight_info(line) == ("Bookmark", 3, None, "2024-03-01T00:05:09")
+    line = "- Your Highlight at Location 10-12 | Added on Friday, March 1, 2024 12:05:09 PM"
+    assert parse_highlight_info(line) == ("Highlight", None, "10-12", "2024-03-01T12:05:09")
+    assert parse_highlight_info("Something else entirely") == ("Unknown", None, None, None)
+
+def test_parse_date_added_matches_strptime():
+    for date_str in [
+        "Sunday, November 10, 2024 11:21:35 AM",
+        "Monday, January 1, 2024 12:00:00 PM",
+        "Monday, January 1, 2024 12:00:00 AM",
+        "Thursday, February 29, 2024 1:02:03 PM",
+        "Tuesday, December 31, 2024 09:59:59 PM",
+    ]:
+        expected = datetime.datetime.strptime(date_str, '%A, %B %d, %Y %I:%M:%S %p').isoformat()
+        assert parse_date_added(date_str) == expected
+
+def test_parse_date_added_rejects_invalid_dates():
+    for date_str in ["Friday, February 30, 2024 1:00:00 PM", "Friday, Smarch 1, 2024 1:00:00 PM", "Friday, March 1, 2024 13:00:00 PM"]:
+        with pytest.raises(ValueError):
+            parse_date_added(date_str)
+
 def test_parse_quote():
     lines = ["This is a quote.", "It spans multiple lines."]
     quote = parse_quote(lines)
@@ -68,4 +93,80 @@ Second quote.
     book1, highlight1 = parsed[0]
     book2, highlight2 = parsed[1]
     assert book1.title == "Churchill"
-    assert book2.title == "Never Split the Difference"
\ No newline at end of file
+    assert book2.title == "Never Split the Difference"
+
+TWO_ENTRIES = """Churchill (Roberts, Andrew)
+- Your Highlight on page 285 | Location 6982-6984 | Added on Sunday, November 10, 2024 11:21:35 AM
+
+First quote.
+==========
+Never Split the Difference (Voss, Chris)
+- Your Highlight on page 12 | Location 199-203 | Added on Sunday, November 10, 2024 12:50:53 PM
+
+Second quote.
+=========="""
+
+def test_iter_clippings_matches_parse_clippings_for_any_chunk_size():
+    expected = parse_clippings(TWO_ENTRIES)
+    for size in (1, 3, 7, 10, 64, 4096):
+        chunks = [TWO_ENTRIES[i:i + size] for i in range(0, len(TWO_ENTRIES), size)]
+        assert list(iter_clippings(chunks)) == expected
+
+def test_iter_clippings_file_objects():
+    expected = parse_clippings(TWO_ENTRIES)
+    assert list(iter_clippings(io.StringIO(TWO_ENTRIES), chunk_size=5)) == expected
+    # Binary input with a BOM and multi-byte characters split across reads
+    data = ('\ufeff' + TWO_ENTRIES.replace('First', 'Fïrst')).encode('utf-8')
+    parsed = list(iter_clippings(io.BytesIO(data), chunk_size=2))
+    assert parsed[0][0].title == "Churchill"
+    assert parsed[0][1].quote == "Fïrst quote."
+    assert parsed[1][1].quote == "Second quote."
+
+def test_iter_clippings_is_lazy():
+    def endless():
+        while True:
+            yield TWO_ENTRIES + "\n"
+    entries = iter_clippings(endless())
+    book, _ = next(entries)
+    assert book.title == "Churchill"
+    book, _ = next(entries)
+    assert book.title == "Never Split the Difference"
+
+def corpus():
+    entries = []
+    for i in range(40):
+        entries.append(TWO_ENTRIES.replace("First", f"First {i} ü").replace("Second", "Second\n\nline " * (i % 3)))
+    # A dangling fragment and an entry without a closing separator
+    entries.append("Incomplete (Nobody)\n==========\n")
+    entries.append(TWO_ENTRIES.rstrip("="))
+    return "\ufeff" + "\n".join(entries)
+
+def test_split_ranges_cover_file_at_separators():
+    data = corpus().encode("utf-8")
+    for chunk_size in (1, 17, 100, 1000, len(data) * 2):
+        ranges = split_ranges(io.BytesIO(data), 0, len(data), chunk_size)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+        assert all(data[:end].endswith(b"==========") for _, end in ranges[:-1])
+
+def test_iter_clippings_parallel_matches_serial(tmp_path):
+    path = tmp_path / "My Clippings.txt"
+    path.write_bytes(corpus().encode("utf-8"))
+    expected = parse_clippings(corpus())
+    assert len(expected) == 82
+    for chunk_size in (50, 400, 10 ** 6):
+        assert list(iter_clippings_parallel(str(path), workers=2, chunk_size=chunk_size)) == expected
+
+    # Starting part way through the file, at an entry boundary
+    start = corpus().encode("utf-8").index(b"==========") + 10
+    assert list(iter_clippings_parallel(str(path), workers=2, start=start, chunk_size=300)) == expected[1:]
+
+def test_synthetic_clippings_are_deterministic_and_parse():
+    text = "".join(iter_clipping_texts(300, books=5, notes=0.1, seed=7))
+    assert text == "".join(iter_clipping_texts(300, books=5, notes=0.1, seed=7))
+    parsed = parse_clippings(text)
+    assert len(parsed) == 300
+    assert len({book.title for book, _ in parsed}) == 5
+    dates = [highlight.date_added for _, highlight in parsed]
+    assert dates == sorted(dates)
+    assert {highlight.highlight_type for _, highlight in parsed} == {"Highlight", "Note"}
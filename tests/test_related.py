@@ -0,0 +1,101 @@
+import os
+import pytest
+import related
+from app.models import Book, Highlight
+from database import connect, create_tables, import_highlights, get_highlight_changes, close_connections
+from related import RelatedIndex, terms, index_path, update_index, find_related
+
+QUOTES = [
+    "Fear is the mind-killer. Fear is the little-death that brings total obliteration.",
+    "I will face my fear. I will permit it to pass over me and through me.",
+    "The spice must flow across the desert planet.",
+    "Deep in the desert the spice harvesters work under the sun.",
+    "It is a truth universally acknowledged that a single man must be in want of a wife.",
+]
+
+def entries(quotes, start=0):
+    book = Book(title="Dune", author="Frank Herbert")
+    for i, quote in enumerate(quotes, start):
+        yield book, Highlight(book_id=None, highlight_type="Highlight", page=None, location=str(i * 10),
+                              date_added=f"2024-01-01T00:00:{i:02d}", quote=quote)
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'bookmarker.db')
+    conn = connect(path)
+    create_tables(conn)
+    import_highlights(conn, entries(QUOTES))
+    conn.close()
+    related._indexes.clear()
+    yield path
+    related._indexes.clear()
+    close_connections(path)
+
+@pytest.fixture
+def conn(db_path):
+    conn = connect(db_path)
+    yield conn
+    conn.close()
+
+def test_terms_drop_stop_words_and_add_pairs():
+    assert terms("The spice must flow!") == ["spice", "must", "flow", "spice must", "must flow"]
+    assert terms("") == []
+
+def test_similar_ranks_shared_terms(conn):
+    index = RelatedIndex()
+    assert index.sync(conn)
+    assert len(index) == len(QUOTES)
+    matches = index.similar(1, k=3)
+    assert matches[0][0] == 2  # the other quote about fear
+    assert all(0 < score <= 1 for _, score in matches)
+    assert [match_id for match_id, _ in index.similar(3, k=1)] == [4]
+    assert 1 not in [match_id for match_id, _ in index.similar(1, k=10)]
+    with pytest.raises(KeyError):
+        index.similar(99)
+
+def test_sync_is_incremental(conn):
+    index = RelatedIndex()
+    index.sync(conn)
+    assert not index.sync(conn)  # nothing changed since
+    import_highlights(conn, entries(["Fear and the desert spice."], start=len(QUOTES)))
+    assert index.sync(conn)
+    assert len(index) == len(QUOTES) + 1
+    assert 6 in [match_id for match_id, _ in index.similar(1, k=10)]
+
+def test_sync_applies_logged_changes(conn):
+    index = RelatedIndex()
+    index.sync(conn)
+    conn.execute("UPDATE highlights SET quote = 'A single man in want of a wife.' WHERE id = 1")
+    conn.execute("DELETE FROM highlights WHERE id = 4")
+    conn.execute("UPDATE import_metadata SET value = value + 1 WHERE key = 'generation'")
+    conn.commit()
+    assert index.sync(conn)
+    assert sorted(index.ids.tolist()) == [1, 2, 3, 5]
+    assert [match_id for match_id, _ in index.similar(1, k=1)] == [5]
+
+def test_save_and_load(conn, tmp_path):
+    index = RelatedIndex()
+    index.sync(conn)
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = RelatedIndex.load(path)
+    assert (loaded.max_id, loaded.generation) == (index.max_id, index.generation)
+    assert loaded.similar(1) == index.similar(1)
+    assert not loaded.sync(conn)
+
+def test_load_rebuilds_unusable_file(tmp_path):
+    path = tmp_path / 'index.npz'
+    path.write_bytes(b'not an index')
+    assert len(RelatedIndex.load(str(path))) == 0
+    assert len(RelatedIndex.load(str(tmp_path / 'missing.npz'))) == 0
+
+def test_update_index_saves_and_prunes(db_path, conn):
+    conn.execute("DELETE FROM highlights WHERE id = 5")
+    conn.execute("UPDATE import_metadata SET value = value + 1 WHERE key = 'generation'")
+    conn.commit()
+    assert update_index(conn, db_path) == len(QUOTES) - 1
+    assert os.path.exists(index_path(db_path))
+    assert get_highlight_changes(conn) == (0, set())
+
+    related._indexes.clear()  # as in a new process
+    assert [match_id for match_id, _ in find_related(conn, db_path, 3, k=1)] == [4]
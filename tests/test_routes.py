@@ -0,0 +1,173 @@
+import io
+import threading
+import time
+import pytest
+from flask import request
+import app.db
+from app import app as flask_app, routes, jobs
+from database import connect, create_tables, close_connections, insert_book, insert_highlight, insert_tag, encode_cursor
+from synthetic import write_clippings
+from config import UPLOAD_SPOOL_SIZE
+from database import SCHEMA_VERSION
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'bookmarker.db')
+    conn = connect(db_path)
+    create_tables(conn)
+    book_id = insert_book(conn, "Dune", "Frank Herbert")
+    insert_highlight(conn, book_id, "Highlight", 1, "1-2", "2024-01-01T00:00:00", "Fear is the mind-killer.")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(app.db, 'DB_PATH', db_path)
+    yield flask_app.test_client()
+    close_connections(db_path)
+
+@pytest.mark.parametrize('url', ['/', '/?book_id=1', '/?q=fear', '/tags', '/api/books/1/highlights', '/api/search?q=fear', '/api/highlights/1/related'])
+def test_conditional_get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+def test_last_modified_only_after_a_write(client):
+    # The fixture's rows were written directly, so the library has no modification time yet
+    response = client.get('/tags')
+    assert 'Last-Modified' not in response.headers
+    assert client.get('/tags', headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}).status_code == 200
+
+    client.post('/tags', data={'action': 'add', 'name': 'classics'})
+    last_modified = client.get('/tags').headers['Last-Modified']
+    assert client.get('/tags', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+def test_etag_changes_with_app_version(client, monkeypatch):
+    etag = client.get('/tags').headers['ETag']
+    assert routes.app_version() in etag
+    monkeypatch.setattr(routes, 'app_version', lambda: 'upgraded')
+    response = client.get('/tags', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_writes_invalidate_etag(client):
+    etag = client.get('/tags').headers['ETag']
+    client.post('/tags', data={'action': 'add', 'name': 'classics'})
+    response = client.get('/tags', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'classics' in response.data
+
+    etag = response.headers['ETag']
+    client.post('/update_highlight_tags', json={'highlight_id': 1, 'tag_ids': [1]})
+    assert client.get('/tags', headers={'If-None-Match': etag}).status_code == 200
+
+def test_post_is_never_conditional(client):
+    etag = client.get('/tags').headers['ETag']
+    response = client.post('/tags', data={'action': 'add', 'name': ''}, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+def test_import_upload_runs_as_job(client, tmp_path):
+    with open(write_clippings(str(tmp_path / 'upload.txt'), 50), 'rb') as f:
+        response = client.post('/imports', data={'clippings_file': (f, 'My Clippings.txt')})
+    assert response.status_code == 302
+    job_id = response.headers['Location'].rsplit('job=', 1)[1]
+    assert jobs.get_job(job_id).completed.wait(10)
+
+    status = client.get(f'/api/imports/{job_id}').get_json()
+    assert status['status'] == 'done'
+    assert status['parsed'] == 50
+    assert b'import-job' in client.get(f'/imports?job={job_id}').data
+    assert client.get('/api/imports/missing').status_code == 404
+
+def test_uploads_spool_to_disk_above_threshold():
+    with flask_app.test_request_context('/imports', method='POST', data={'clippings_file': (io.BytesIO(b'x' * 10), 'small.txt')}):
+        assert not request.files['clippings_file'].stream._rolled
+    large = b'x' * (UPLOAD_SPOOL_SIZE + 1)
+    with flask_app.test_request_context('/imports', method='POST', data={'clippings_file': (io.BytesIO(large), 'large.txt')}):
+        assert request.files['clippings_file'].stream._rolled
+
+def test_upload_size_limit(client, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'MAX_CONTENT_LENGTH', 1024)
+    response = client.post('/imports', data={'clippings_file': (io.BytesIO(b'x' * 2048), 'My Clippings.txt')})
+    assert response.status_code == 413
+    assert b'too large' in response.data
+
+def test_schema_created_on_first_request(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'fresh.db')
+    monkeypatch.setattr(app.db, 'DB_PATH', db_path)
+    assert flask_app.test_client().get('/tags').status_code == 200
+    conn = connect(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    conn.close()
+    close_connections(db_path)
+
+def test_export_streams_attachment(client):
+    response = client.get('/export?format=markdown')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/markdown'
+    assert 'highlights.md' in response.headers['Content-Disposition']
+    assert response.get_data(as_text=True).startswith("## Dune\n")
+    assert client.get('/export?format=xml').status_code == 400
+    assert client.get('/export?since=soon').status_code == 400
+
+def test_related_highlights_api(client):
+    conn = connect(app.db.DB_PATH)
+    insert_highlight(conn, 1, "Highlight", 2, "3-4", "2024-01-02T00:00:00", "Fear is the little-death.")
+    insert_highlight(conn, 1, "Highlight", 3, "5-6", "2024-01-03T00:00:00", "The spice must flow.")
+    conn.commit()
+    conn.close()
+    response = client.get('/api/highlights/1/related')
+    assert response.status_code == 200
+    [match] = response.get_json()['related']
+    assert (match['id'], match['book']['title']) == (2, "Dune")
+    assert 0 < match['score'] <= 1
+    assert client.get('/api/highlights/99/related').status_code == 404
+
+def test_malformed_cursor_is_a_bad_request(client):
+    for cursor in ("not a cursor", encode_cursor([1], {})):
+        assert client.get(f'/api/books/1/highlights?cursor={cursor}').status_code == 400
+        assert client.get(f'/api/search?q=fear&cursor={cursor}').status_code == 400
+
+def test_search_falls_back_to_close_spellings(client):
+    # The fixture's highlight was written without the importer, so its words are added here
+    conn = connect(app.db.DB_PATH)
+    conn.execute("INSERT INTO search_terms (term) VALUES ('killer'), ('mind'), ('fear')")
+    conn.commit()
+    conn.close()
+    response = client.get('/?q=minds+kiler')
+    assert b'No exact matches' in response.data
+    assert b'<mark>killer</mark>' in response.data
+
+    data = client.get('/api/search?q=minds+kiler').get_json()
+    assert [h['quote'] for h in data['highlights']] == ["Fear is the mind-killer."]
+    assert data['corrections'] == "mind killer"
+    assert data['next_cursor'] is None
+    assert client.get('/api/search?q=fear').get_json()['corrections'] is None
+
+def test_schema_checked_once_by_concurrent_first_requests(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'fresh.db')
+    monkeypatch.setattr(app.db, 'DB_PATH', db_path)
+    calls = []
+
+    def slow_create_tables(conn):
+        calls.append(conn)
+        time.sleep(0.1)
+        create_tables(conn)
+
+    monkeypatch.setattr(app.db, 'create_tables', slow_create_tables)
+
+    def first_request():
+        with flask_app.app_context():
+            app.db.get_db()
+
+    threads = [threading.Thread(target=first_request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1
+    close_connections(db_path)
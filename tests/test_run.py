@@ -0,0 +1,94 @@
+import http.client
+import socket
+import threading
+import time
+import pytest
+from run import parse_args, create_production_server, listeners, serve
+
+def slow_app(environ, start_response):
+    time.sleep(float(environ.get('QUERY_STRING') or 0))
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'done']
+
+@pytest.fixture
+def server():
+    server = create_production_server(slow_app, '127.0.0.1', 0, threads=2)
+    stop = threading.Event()
+    thread = threading.Thread(target=serve, args=(server, stop, 5))
+    thread.start()
+    yield server, stop, thread
+    if thread.is_alive():
+        stop.set()
+        server.pull_trigger()
+        thread.join(10)
+
+def test_parse_args_defaults_to_desktop_mode():
+    args = parse_args([])
+    assert not args.production
+    assert args.port == 5001
+    args = parse_args(['--production', '--threads', '4', '--drain-timeout', '5'])
+    assert args.production and args.threads == 4 and args.drain_timeout == 5
+
+def test_serve_keeps_connections_alive(server):
+    server, _, _ = server
+    conn = http.client.HTTPConnection('127.0.0.1', server.effective_port, timeout=5)
+    for _ in range(3):
+        conn.request('GET', '/')
+        response = conn.getresponse()
+        assert response.read() == b'done'
+        assert response.getheader('Connection') != 'close'
+    conn.close()
+
+def test_stop_drains_in_flight_requests(server):
+    server, stop, thread = server
+    port = server.effective_port
+    idle = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    idle.request('GET', '/')
+    idle.getresponse().read()
+
+    busy = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    busy.request('GET', '/?0.5')
+    time.sleep(0.1)
+    stop.set()
+    server.pull_trigger()
+
+    response = busy.getresponse()
+    assert response.status == 200
+    assert response.read() == b'done'
+    thread.join(5)
+    assert not thread.is_alive()
+    with pytest.raises(OSError):
+        http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('GET', '/')
+
+def test_stop_drains_every_address_of_a_multi_address_host(monkeypatch):
+    real_getaddrinfo = socket.getaddrinfo
+
+    def two_addresses(host, *args, **kwargs):
+        if host == 'dualstack.test':
+            return real_getaddrinfo('127.0.0.1', *args, **kwargs) * 2
+        return real_getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', two_addresses)
+    server = create_production_server(slow_app, 'dualstack.test', 0, threads=2)
+    ports = [listener.effective_port for listener in listeners(server)]
+    assert len(ports) == 2
+    stop = threading.Event()
+    thread = threading.Thread(target=serve, args=(server, stop, 5))
+    thread.start()
+
+    busy = []
+    for port in ports:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('GET', '/?0.5')
+        busy.append(conn)
+    time.sleep(0.1)
+    stop.set()
+    listeners(server)[0].pull_trigger()
+
+    for conn in busy:
+        assert conn.getresponse().read() == b'done'
+    thread.join(5)
+    assert not thread.is_alive()
+    for port in ports:
+        with pytest.raises(OSError):
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('GET', '/')